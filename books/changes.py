@@ -0,0 +1,64 @@
+"""
+The ``/api/changes/`` feed, for replicas that mirror the catalog.
+
+The signal handlers in ``books.signals`` write a ``ChangeLogEntry`` for every
+created, updated or deleted book and author, and an update for each book whose
+authors change. A replica stores the ``next_cursor`` of each batch and asks for
+``?since=<cursor>`` next time, so it only downloads what changed.
+
+Within a batch, the entries of one object collapse into a single change that
+carries the object as it is now. Objects that no longer exist are reported as
+deleted with no data. Cursors are only monotonic if writes commit in id order,
+which holds on SQLite since it serializes writes.
+"""
+from django.conf import settings
+
+from .models import Author, Book, ChangeLogEntry
+from .serializers import AuthorSerializer, BookSerializer
+
+FEED_MODELS = {
+    'book': (Book.objects.prefetch_related('authors'), BookSerializer),
+    'author': (Author.objects.all(), AuthorSerializer),
+}
+
+
+def changes_since(since, limit=None):
+    """Return the changes logged after cursor ``since``, at most ``limit`` log entries at a time."""
+    limit = limit or getattr(settings, 'BOOKS_CHANGES_PAGE_SIZE', 100)
+    entries = list(ChangeLogEntry.objects.filter(pk__gt=since).order_by('pk')[:limit + 1])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    latest = {}
+    for entry in entries:
+        latest.pop((entry.model, entry.object_id), None)
+        latest[entry.model, entry.object_id] = entry
+
+    current = {}
+    for model, (queryset, _) in FEED_MODELS.items():
+        ids = [object_id for name, object_id in latest if name == model]
+        if ids:
+            current[model] = queryset.in_bulk(ids)
+
+    changes = []
+    for (model, object_id), entry in latest.items():
+        instance = current.get(model, {}).get(object_id)
+        action = entry.action
+        if instance is None:
+            action = ChangeLogEntry.DELETED
+        elif action == ChangeLogEntry.DELETED:
+            # The id was reused by an object created since.
+            action = ChangeLogEntry.CREATED
+        changes.append({
+            'cursor': entry.pk,
+            'model': model,
+            'id': object_id,
+            'action': action,
+            'at': entry.created_at,
+            'data': None if instance is None else FEED_MODELS[model][1](instance).data,
+        })
+    return {
+        'changes': changes,
+        'next_cursor': entries[-1].pk if entries else since,
+        'has_more': has_more,
+    }
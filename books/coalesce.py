@@ -0,0 +1,236 @@
+"""
+Single-flight coalescing of identical concurrent GET requests.
+
+Concurrent requests with the same key wait for the first one (the leader) and
+reuse its rendered response instead of running the same queries. When
+``BOOKS_COALESCE_LOCK_DIR`` is set, leaders also take an ``flock`` lease per
+key there. Requests in other worker processes then wait for that lease and
+read the response the leader wrote next to it. Followers wait at most
+``BOOKS_COALESCE_TIMEOUT`` seconds. After that, or if the leader fails or
+gets anything but a 200, they compute the response themselves.
+
+Only anonymous requests are coalesced: followers skip authentication and
+permission checks, so requests with credentials never share a response.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .utils import normalized_params
+
+
+class SharedResponse:
+    """The parts of a rendered response that can be handed to other requests."""
+
+    def __init__(self, status, headers, content):
+        self.status = status
+        self.headers = headers
+        self.content = content
+
+    @classmethod
+    def from_response(cls, response):
+        if response.streaming or response.status_code != 200:
+            return None
+        if hasattr(response, 'render'):
+            response.render()
+        return cls(response.status_code, list(response.items()), response.content)
+
+    def to_response(self):
+        response = HttpResponse(self.content, status=self.status)
+        for name, value in self.headers:
+            response[name] = value
+        return response
+
+    def dumps(self):
+        header = json.dumps({'status': self.status, 'headers': self.headers}).encode()
+        return header + b'\n' + self.content
+
+    @classmethod
+    def loads(cls, data):
+        header, content = data.split(b'\n', 1)
+        header = json.loads(header)
+        return cls(header['status'], [tuple(item) for item in header['headers']], content)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """Runs at most one computation per key at a time within this process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, compute, timeout):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if call.done.wait(timeout) and call.result is not None:
+                return call.result
+            # The leader is stuck, failed or produced nothing shareable.
+            return compute()
+        try:
+            call.result = compute()
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+
+def _try_lock(fd):
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class FileLease:
+    """Cross-process single flight through an ``flock``-ed file per key."""
+
+    poll_interval = 0.01
+    sweep_interval = 60.0
+    swept_at = 0.0
+
+    def __init__(self, directory, key):
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        self.lock_path = directory / f'{key}.lock'
+        self.result_path = directory / f'{key}.response'
+
+    def run(self, compute, timeout):
+        started = time.time()
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if _try_lock(fd):
+                return self._lead(fd, compute)
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                if _try_lock(fd):
+                    return self._read(since=started) or self._lead(fd, compute)
+            return compute()
+        finally:
+            # Closing the descriptor releases the lock, also if the process dies.
+            os.close(fd)
+
+    def _lead(self, fd, compute):
+        # Keys in use keep a recent mtime, so sweep() leaves their lock files alone.
+        os.utime(fd)
+        result = compute()
+        if result is not None:
+            tmp = self.result_path.with_name(f'.{self.result_path.name}.{os.getpid()}.tmp')
+            tmp.write_bytes(result.dumps())
+            os.replace(tmp, self.result_path)
+        return result
+
+    def _read(self, since):
+        # Only a response written while we waited counts; older ones are stale.
+        try:
+            if self.result_path.stat().st_mtime < since:
+                return None
+            return SharedResponse.loads(self.result_path.read_bytes())
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def sweep(cls, directory, max_age):
+        """
+        Delete responses older than ``max_age`` seconds, which no follower can
+        still use, and lock files unused for as long that nobody holds.
+        """
+        cutoff = time.time() - max_age
+        try:
+            paths = list(Path(directory).iterdir())
+        except OSError:
+            return
+        for path in paths:
+            try:
+                if path.stat().st_mtime >= cutoff:
+                    continue
+                if path.suffix in ('.response', '.tmp'):
+                    path.unlink()
+                elif path.suffix == '.lock':
+                    fd = os.open(path, os.O_RDWR)
+                    try:
+                        if _try_lock(fd):
+                            path.unlink()
+                    finally:
+                        os.close(fd)
+            except OSError:
+                continue
+
+    @classmethod
+    def maybe_sweep(cls, directory, max_age):
+        now = time.monotonic()
+        if now - cls.swept_at >= cls.sweep_interval:
+            cls.swept_at = now
+            cls.sweep(directory, max_age)
+
+
+single_flight = SingleFlight()
+
+
+def coalesce_key(request):
+    """
+    Key identifying requests that would get identical responses, or None for
+    requests that must not be coalesced (unsafe methods, requests with
+    credentials, HTML pages that embed the user and a CSRF token).
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    if 'Authorization' in request.headers or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return None
+    accept = request.headers.get('Accept', '')
+    if 'html' in accept or request.GET.get('format') == 'api':
+        return None
+    # Paginated responses embed absolute next/previous links.
+    parts = [request.method, request.scheme, request.get_host(), request.path, normalized_params(request.GET), accept]
+    return hashlib.sha1(json.dumps(parts).encode()).hexdigest()
+
+
+def coalesce(key, compute):
+    """Return ``compute()``'s SharedResponse, sharing it with identical concurrent callers."""
+    timeout = getattr(settings, 'BOOKS_COALESCE_TIMEOUT', 5.0)
+    lock_dir = getattr(settings, 'BOOKS_COALESCE_LOCK_DIR', None)
+    if not lock_dir:
+        return single_flight.do(key, compute, timeout)
+    # Followers only accept responses written while they waited, at most ``timeout`` ago.
+    FileLease.maybe_sweep(lock_dir, max_age=2 * timeout)
+    return single_flight.do(key, lambda: FileLease(lock_dir, key).run(compute, timeout), timeout)
+
+
+class CoalescingViewMixin:
+    """Coalesces identical concurrent GET requests to a view."""
+
+    def dispatch(self, request, *args, **kwargs):
+        key = coalesce_key(request)
+        if key is None:
+            return super().dispatch(request, *args, **kwargs)
+        dispatch = super().dispatch
+        own = []
+
+        def compute():
+            response = dispatch(request, *args, **kwargs)
+            own.append(response)
+            return SharedResponse.from_response(response)
+
+        shared = coalesce(key, compute)
+        if own:
+            return own[0]
+        return shared.to_response()
@@ -8,9 +8,15 @@ class BookFilter(django_filters.FilterSet):
         method='filter_authors',
         label='Authors'
     )
+    all_authors = django_filters.ModelMultipleChoiceFilter(
+        queryset=Author.objects.all(),
+        method='filter_all_authors',
+        label='All authors'
+    )
     
     title = django_filters.CharFilter(lookup_expr='icontains')
     genre = django_filters.CharFilter(lookup_expr='icontains')
+    isbn = django_filters.CharFilter()
     min_price = django_filters.NumberFilter(field_name='price', lookup_expr='gte')
     max_price = django_filters.NumberFilter(field_name='price', lookup_expr='lte')
     
@@ -18,7 +24,13 @@ class BookFilter(django_filters.FilterSet):
         if not value:
             return queryset
         return queryset.filter(authors__in=value).distinct()
+
+    def filter_all_authors(self, queryset, name, value):
+        # One join per author; each matches at most one row per book.
+        for author in value:
+            queryset = queryset.filter(authors=author)
+        return queryset
     
     class Meta:
         model = Book
-        fields = ['title', 'genre', 'authors', 'min_price', 'max_price']    
\ No newline at end of file
+        fields = ['title', 'genre', 'isbn', 'authors', 'all_authors', 'min_price', 'max_price']    
\ No newline at end of file
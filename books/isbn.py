@@ -0,0 +1,89 @@
+"""ISBN normalization and the in-process cache behind bulk ISBN resolution."""
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+_SEPARATORS = re.compile(r'[\s-]')
+
+
+def isbn10_is_valid(value):
+    if len(value) != 10 or not value[:9].isdigit() or not (value[9].isdigit() or value[9] == 'X'):
+        return False
+    digits = [int(c) for c in value[:9]] + [10 if value[9] == 'X' else int(value[9])]
+    return sum((10 - i) * digit for i, digit in enumerate(digits)) % 11 == 0
+
+
+def isbn13_check_digit(first12):
+    total = sum(int(c) * (3 if i % 2 else 1) for i, c in enumerate(first12))
+    return str((10 - total % 10) % 10)
+
+
+def isbn10_to_isbn13(value):
+    first12 = '978' + value[:9]
+    return first12 + isbn13_check_digit(first12)
+
+
+def normalize_isbn(value):
+    """
+    Strip hyphens and whitespace and convert valid ISBN-10s to ISBN-13, so each
+    book has one stored form. Anything else is returned without separators.
+    """
+    if value is None:
+        return None
+    compact = _SEPARATORS.sub('', str(value)).upper()
+    if isbn10_is_valid(compact):
+        return isbn10_to_isbn13(compact)
+    return compact
+
+
+_MISSING = object()
+
+
+class ISBNCache:
+    """
+    Bounded LRU of normalized ISBN -> serialized book (or None for unknown
+    ISBNs). Signal handlers clear it on every book or author write; entries
+    also expire after ``BOOKS_ISBN_CACHE_TTL`` seconds so writes made by other
+    worker processes are picked up.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, isbns):
+        """Return ``(hits, misses)`` for ``isbns``."""
+        hits, misses = {}, []
+        now = time.monotonic()
+        with self._lock:
+            for isbn in isbns:
+                expires_at, value = self._entries.get(isbn, (0, _MISSING))
+                if value is _MISSING or expires_at < now:
+                    misses.append(isbn)
+                else:
+                    self._entries.move_to_end(isbn)
+                    hits[isbn] = value
+        return hits, misses
+
+    def set_many(self, mapping):
+        maxsize = getattr(settings, 'BOOKS_ISBN_CACHE_SIZE', 10000)
+        expires_at = time.monotonic() + getattr(settings, 'BOOKS_ISBN_CACHE_TTL', 60)
+        with self._lock:
+            for isbn, value in mapping.items():
+                self._entries[isbn] = (expires_at, value)
+                self._entries.move_to_end(isbn)
+            while len(self._entries) > maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+isbn_cache = ISBNCache()
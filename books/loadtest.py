@@ -0,0 +1,385 @@
+"""
+In-process load generator for ``library.wsgi.application`` and
+``library.asgi.application``, used by ``manage.py loadtest``.
+
+Requests are built as WSGI environs or ASGI scopes and passed straight to the
+application, so a run measures the full middleware/view/render stack without
+a network or an external tool.
+"""
+import asyncio
+import io
+import json
+import multiprocessing
+import random
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode
+
+from . import metrics
+
+# Books created by the write scenario carry this title prefix so they can be cleaned up.
+LOADTEST_PREFIX = '[loadtest]'
+PRICE_RANGES = [(None, 20), (20, 50), (50, None), (10, 100)]
+ORDERINGS = ['title', '-price', 'price', '-publication_date']
+
+
+class Request:
+    def __init__(self, operation, method, path, params=None, body=None, on_success=None):
+        self.operation = operation
+        self.method = method
+        self.path = path
+        self.query = urlencode(params or {}, doseq=True)
+        self.body = body or b''
+        # Called with the response body of a successful request.
+        self.on_success = on_success
+
+
+def filter_mix(rng, data, state):
+    params = {}
+    choice = rng.random()
+    if choice < 0.3 and data['genres']:
+        params['genre'] = rng.choice(data['genres'])
+    elif choice < 0.55:
+        low, high = rng.choice(PRICE_RANGES)
+        if low is not None:
+            params['min_price'] = low
+        if high is not None:
+            params['max_price'] = high
+    elif choice < 0.8 and data['author_ids']:
+        params['authors'] = rng.sample(data['author_ids'], min(2, len(data['author_ids'])))
+    elif data['pages'] > 1 and rng.random() < 0.5:
+        # Only unfiltered listings are known to have this many pages.
+        params['page'] = rng.randint(2, data['pages'])
+    if rng.random() < 0.5:
+        params['ordering'] = rng.choice(ORDERINGS)
+    return Request('filter', 'GET', '/api/books/', params)
+
+
+def search(rng, data, state):
+    params = {'search': rng.choice(data['words'])}
+    if rng.random() < 0.3:
+        params['ordering'] = rng.choice(ORDERINGS)
+    return Request('search', 'GET', '/api/books/', params)
+
+
+def book_detail(rng, data, state):
+    return Request('book_detail', 'GET', f"/api/books/{rng.choice(data['book_ids'])}/")
+
+
+def author_detail(rng, data, state):
+    if not data['author_ids']:
+        return book_detail(rng, data, state)
+    return Request('author_detail', 'GET', f"/api/authors/{rng.choice(data['author_ids'])}/")
+
+
+def by_genre(rng, data, state):
+    return Request('by_genre', 'GET', '/api/books/by_genre/', {'genre': rng.choice(data['genres'] or [''])})
+
+
+def write(rng, data, state):
+    """Create, update or delete books this worker created itself."""
+    created = state.setdefault('created', [])
+    choice = rng.random()
+    if created and choice < 0.3:
+        return Request('delete', 'DELETE', f'/api/books/{created.pop()}/')
+    if created and choice < 0.7:
+        body = json.dumps({'price': f'{rng.uniform(5, 100):.2f}'}).encode()
+        return Request('update', 'PATCH', f'/api/books/{rng.choice(created)}/', body=body)
+    body = json.dumps({
+        'title': f'{LOADTEST_PREFIX} {uuid.uuid4().hex[:12]}',
+        'genre': rng.choice(data['genres'] or ['Fiction']),
+        'price': f'{rng.uniform(5, 100):.2f}',
+    }).encode()
+    return Request(
+        'create', 'POST', '/api/books/', body=body,
+        on_success=lambda content: created.append(json.loads(content)['id']),
+    )
+
+
+SCENARIOS = {
+    'filters': [(1, filter_mix)],
+    'search': [(1, search)],
+    'detail': [(3, book_detail), (1, author_detail)],
+    'writes': [(1, write)],
+    'mixed': [(5, filter_mix), (2, search), (3, book_detail), (1, author_detail), (1, by_genre), (1, write)],
+}
+
+
+def scenario_writes(name):
+    return any(step is write for _, step in SCENARIOS[name])
+
+
+def load_application(kind):
+    if kind == 'asgi':
+        from library.asgi import application
+    else:
+        from library.wsgi import application
+    return application
+
+
+def call_wsgi(app, request, headers):
+    environ = {
+        'REQUEST_METHOD': request.method,
+        'SCRIPT_NAME': '',
+        'PATH_INFO': request.path,
+        'QUERY_STRING': request.query,
+        'SERVER_NAME': headers['Host'],
+        'SERVER_PORT': '80',
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'REMOTE_ADDR': '127.0.0.1',
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(request.body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(request.body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for name, value in headers.items():
+        environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+    status = []
+    body = app(environ, lambda status_line, response_headers, exc_info=None: status.append(status_line))
+    try:
+        content = b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return int(status[0].split(' ', 1)[0]), content
+
+
+async def call_asgi(app, request, headers):
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': request.method,
+        'scheme': 'http',
+        'path': request.path,
+        'raw_path': request.path.encode(),
+        'query_string': request.query.encode(),
+        'root_path': '',
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(request.body)).encode()),
+            *((name.lower().encode(), value.encode()) for name, value in headers.items()),
+        ],
+        'client': ('127.0.0.1', 0),
+        'server': (headers['Host'], 80),
+    }
+    messages = [{'type': 'http.request', 'body': request.body, 'more_body': False}]
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    status = []
+    content = []
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            status.append(message['status'])
+        elif message['type'] == 'http.response.body':
+            content.append(message.get('body', b''))
+
+    await app(scope, receive, send)
+    disconnected.set()
+    return status[0], b''.join(content)
+
+
+def _query_totals():
+    """Total queries and requests counted so far by this process's metrics registry."""
+    queries = requests = 0
+    for metric, _, values in metrics.registry.snapshot():
+        if metric == 'books_request_queries':
+            queries += values[-2]
+            requests += values[-1]
+    return queries, requests
+
+
+def _measured(run_workers):
+    queries_before, requests_before = _query_totals()
+    samples = run_workers()
+    queries_after, requests_after = _query_totals()
+    return {
+        'samples': samples,
+        'queries': queries_after - queries_before,
+        'counted_requests': requests_after - requests_before,
+    }
+
+
+def run_worker(config, worker_index, stop_at, budget):
+    """
+    Send requests until ``stop_at`` or until the shared request budget runs
+    out. Returns ``(operation, status, latency, size)`` samples.
+    """
+    rng = random.Random(f"{config['seed']}-{worker_index}")
+    app = load_application(config['app'])
+    steps = SCENARIOS[config['scenario']]
+    weights = [weight for weight, _ in steps]
+    state = {}
+    samples = []
+
+    def next_request():
+        step = rng.choices(steps, weights)[0][1]
+        return step(rng, config['data'], state)
+
+    def take_budget():
+        return budget is None or budget.acquire(False)
+
+    def record(request, status, content, latency):
+        samples.append((request.operation, status, latency, len(content)))
+        if request.on_success is not None and not is_error(status):
+            request.on_success(content)
+
+    if config['app'] == 'asgi':
+        async def loop():
+            while time.monotonic() < stop_at and take_budget():
+                request = next_request()
+                start = time.perf_counter()
+                try:
+                    status, content = await call_asgi(app, request, config['headers'])
+                except Exception as exc:
+                    status, content = type(exc).__name__, b''
+                record(request, status, content, time.perf_counter() - start)
+        asyncio.run(loop())
+    else:
+        while time.monotonic() < stop_at and take_budget():
+            request = next_request()
+            start = time.perf_counter()
+            try:
+                status, content = call_wsgi(app, request, config['headers'])
+            except Exception as exc:
+                status, content = type(exc).__name__, b''
+            record(request, status, content, time.perf_counter() - start)
+    return samples
+
+
+_process_budget = None
+
+
+def _init_process(budget):
+    # Semaphores can only reach pool processes through inheritance.
+    global _process_budget
+    _process_budget = budget
+
+
+def _process_worker(config, worker_index, stop_at_wall):
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    # Each process has its own monotonic clock origin; convert from wall time.
+    stop_at = time.monotonic() + max(0.0, stop_at_wall - time.time())
+    return _measured(lambda: run_worker(config, worker_index, stop_at, _process_budget))
+
+
+def run(config, workers, mode, duration, max_requests=None):
+    """
+    Drive the application with ``workers`` threads or processes. Returns the
+    samples of all workers and the queries the metrics registry counted.
+    """
+    if mode == 'processes':
+        from django.db import connections
+        connections.close_all()
+        context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+        budget = context.Semaphore(max_requests) if max_requests else None
+        stop_at_wall = time.time() + duration
+        with context.Pool(workers, initializer=_init_process, initargs=(budget,)) as pool:
+            results = pool.starmap(_process_worker, [(config, index, stop_at_wall) for index in range(workers)])
+        return {
+            'samples': [sample for result in results for sample in result['samples']],
+            'queries': sum(result['queries'] for result in results),
+            'counted_requests': sum(result['counted_requests'] for result in results),
+        }
+
+    budget = threading.Semaphore(max_requests) if max_requests else None
+    stop_at = time.monotonic() + duration
+    results = [[] for _ in range(workers)]
+
+    def target(index):
+        from django.db import connections
+        try:
+            results[index] = run_worker(config, index, stop_at, budget)
+        finally:
+            connections.close_all()
+
+    def run_threads():
+        threads = [threading.Thread(target=target, args=(index,)) for index in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return [sample for samples in results for sample in samples]
+
+    # The threads share this process's registry, so count around all of them.
+    return _measured(run_threads)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+def latency_summary(latencies):
+    latencies = sorted(latencies)
+    return {
+        'mean': _ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50': _ms(percentile(latencies, 0.50)),
+        'p90': _ms(percentile(latencies, 0.90)),
+        'p95': _ms(percentile(latencies, 0.95)),
+        'p99': _ms(percentile(latencies, 0.99)),
+        'max': _ms(latencies[-1]) if latencies else None,
+    }
+
+
+def is_error(status):
+    return not isinstance(status, int) or status >= 400
+
+
+def summarize(result, elapsed):
+    """Build the JSON report for a ``run()`` result that took ``elapsed`` seconds."""
+    samples = result['samples']
+    total = len(samples)
+    errors = sum(1 for _, status, _, _ in samples if is_error(status))
+    statuses = {}
+    operations = {}
+    for operation, status, latency, _ in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        operations.setdefault(operation, []).append((status, latency))
+    queries = result['queries']
+    counted = result['counted_requests']
+    return {
+        'requests': total,
+        'duration_s': round(elapsed, 3),
+        'requests_per_sec': round(total / elapsed, 2) if elapsed else None,
+        'errors': errors,
+        'error_rate': round(errors / total, 4) if total else 0.0,
+        'latency_ms': latency_summary([latency for _, _, latency, _ in samples]),
+        'bytes_out': sum(size for _, _, _, size in samples),
+        'queries': {
+            'total': int(queries),
+            'per_request': round(queries / counted, 3) if counted else None,
+        },
+        'status_codes': dict(sorted(statuses.items())),
+        'operations': {
+            operation: {
+                'requests': len(entries),
+                'errors': sum(1 for status, _ in entries if is_error(status)),
+                'latency_ms': latency_summary([latency for _, latency in entries]),
+            }
+            for operation, entries in sorted(operations.items())
+        },
+    }
@@ -0,0 +1,79 @@
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+
+from books.models import Author, Book
+from books.renderers import ColumnarJSONRenderer, ColumnarQuery
+from books.serializers import BookListSerializer, BookSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare response size and throughput of the columnar renderer against JSONRenderer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=20)
+        parser.add_argument(
+            '--books', type=int, default=0,
+            help='Benchmark against N synthetic books (rolled back afterwards) instead of the current data.'
+        )
+        parser.add_argument('--authors', type=int, default=50, help='Authors shared by the synthetic books.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['books']:
+                self.create_books(options['books'], options['authors'])
+            for serializer_class in (BookListSerializer, BookSerializer):
+                self.compare(serializer_class, options['iterations'])
+            transaction.set_rollback(True)
+
+    def create_books(self, count, author_count):
+        authors = Author.objects.bulk_create(
+            Author(name=f'Author {i}', bio='Synthetic author') for i in range(author_count)
+        )
+        books = Book.objects.bulk_create(
+            Book(
+                title=f'Book {i}',
+                isbn=f'{i:013d}',
+                publication_date=date(2000 + i % 25, 1 + i % 12, 1),
+                price=Decimal(i % 100) + Decimal('0.99'),
+                genre=('Fantasy', 'Science Fiction', 'History')[i % 3],
+            )
+            for i in range(count)
+        )
+        Through = Book.authors.through
+        Through.objects.bulk_create(
+            Through(book_id=book.pk, author_id=authors[(i + j) % author_count].pk)
+            for i, book in enumerate(books) for j in range(2)
+        )
+
+    def compare(self, serializer_class, iterations):
+        queryset = Book.objects.all()
+
+        def default():
+            data = serializer_class(queryset.prefetch_related('authors'), many=True).data
+            return JSONRenderer().render(data)
+
+        def columnar():
+            query = ColumnarQuery(serializer_class(), queryset)
+            return ColumnarJSONRenderer().render(query.columns(query.values()))
+
+        rows = queryset.count()
+        self.stdout.write(f'{serializer_class.__name__} ({rows} rows, {iterations} iterations)')
+        baseline = None
+        for name, render in (('json', default), ('columnar', columnar)):
+            content = render()
+            start = time.perf_counter()
+            for _ in range(iterations):
+                render()
+            elapsed = (time.perf_counter() - start) / iterations
+            rows_per_sec = rows / elapsed if elapsed else 0
+            line = f'  {name:<9} {len(content):>10} bytes {elapsed * 1000:>9.2f} ms {rows_per_sec:>12.0f} rows/s'
+            if baseline is None:
+                baseline = (len(content), elapsed)
+            else:
+                line += f'  size x{len(content) / baseline[0]:.2f}, time x{elapsed / baseline[1]:.2f}'
+            self.stdout.write(line)
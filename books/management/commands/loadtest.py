@@ -0,0 +1,131 @@
+import json
+import logging
+import platform
+import time
+
+import django
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils.crypto import get_random_string
+from rest_framework.settings import api_settings
+
+from books import loadtest
+from books.models import Author, Book
+from books.utils import default_host
+
+
+class Command(BaseCommand):
+    help = 'Drive the WSGI or ASGI application in-process with concurrent workers and report throughput as JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument('--mode', choices=['threads', 'processes'], default='threads')
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds to run for.')
+        parser.add_argument('--requests', type=int, default=None, help='Stop after this many requests in total.')
+        parser.add_argument('--scenario', choices=sorted(loadtest.SCENARIOS), default='mixed')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--warmup', type=float, default=0.0, help='Seconds of unmeasured requests before the run.')
+        parser.add_argument('--host', default=None, help='Host header for the requests.')
+        parser.add_argument('--output', default=None, help='Write the JSON report here instead of stdout.')
+        parser.add_argument(
+            '--allow-writes', action='store_true',
+            help='Required for scenarios that create, update and delete books.',
+        )
+
+    def handle(self, *args, **options):
+        scenario = options['scenario']
+        writes = loadtest.scenario_writes(scenario)
+        if writes and not options['allow_writes']:
+            raise CommandError(f'The {scenario} scenario writes to the database; pass --allow-writes to run it.')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1.')
+
+        config = {
+            'seed': options['seed'],
+            'app': options['app'],
+            'scenario': scenario,
+            'data': self.sample_data(),
+            'headers': {'Host': options['host'] or default_host(), 'Accept': 'application/json'},
+        }
+        session_key = self.login(config['headers']) if writes else None
+
+        # Loading the application runs django.setup(), which reconfigures logging.
+        loadtest.load_application(options['app'])
+        # 404s and validation errors are counted in the report; don't log each one.
+        request_logger = logging.getLogger('django.request')
+        level = request_logger.level
+        request_logger.setLevel(logging.ERROR)
+        try:
+            if options['warmup'] > 0:
+                loadtest.run(config, options['workers'], options['mode'], options['warmup'])
+            start = time.perf_counter()
+            result = loadtest.run(config, options['workers'], options['mode'], options['duration'], options['requests'])
+            elapsed = time.perf_counter() - start
+        finally:
+            request_logger.setLevel(level)
+            if writes:
+                self.clean_up(session_key)
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'app': options['app'],
+                'mode': options['mode'],
+                'workers': options['workers'],
+                'scenario': scenario,
+                'seed': options['seed'],
+            },
+            **loadtest.summarize(result, elapsed),
+        }
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+            self.stderr.write(
+                f"{report['requests']} requests, {report['requests_per_sec']} req/s, "
+                f"{report['errors']} errors; report written to {options['output']}"
+            )
+        else:
+            self.stdout.write(output)
+
+    def sample_data(self):
+        book_ids = list(Book.objects.values_list('pk', flat=True))
+        if not book_ids:
+            raise CommandError('There are no books to load test against.')
+        titles = Book.objects.values_list('title', flat=True)[:1000]
+        words = sorted({word.lower() for title in titles for word in title.split() if len(word) > 3})
+        page_size = api_settings.PAGE_SIZE or len(book_ids)
+        return {
+            'book_ids': book_ids,
+            'pages': -(-len(book_ids) // page_size),
+            'author_ids': list(Author.objects.values_list('pk', flat=True)),
+            'genres': sorted(set(Book.objects.exclude(genre='').values_list('genre', flat=True))),
+            'words': words or ['the'],
+        }
+
+    def login(self, headers):
+        """Log a dedicated user in and add its session and CSRF headers; return the session key."""
+        user, created = get_user_model().objects.get_or_create(username='loadtest')
+        if created:
+            user.set_unusable_password()
+            user.save()
+        client = Client()
+        client.force_login(user)
+        session_key = client.cookies[settings.SESSION_COOKIE_NAME].value
+        token = get_random_string(32)
+        headers['Cookie'] = f'{settings.SESSION_COOKIE_NAME}={session_key}; {settings.CSRF_COOKIE_NAME}={token}'
+        headers['X-CSRFToken'] = token
+        return session_key
+
+    def clean_up(self, session_key):
+        deleted, _ = Book.objects.filter(title__startswith=loadtest.LOADTEST_PREFIX).delete()
+        Session.objects.filter(session_key=session_key).delete()
+        if deleted:
+            self.stderr.write(f'Deleted {deleted} rows created by the load test.')
@@ -0,0 +1,95 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books import startup
+
+
+class Command(BaseCommand):
+    help = (
+        'Profile a cold start in fresh interpreters: django.setup(), the WSGI/ASGI handler and the first '
+        'requests, with import time broken down by module.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', choices=['wsgi', 'asgi'], default='wsgi')
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help='Path to request after boot; repeat for several. Defaults to /api/books/.',
+        )
+        parser.add_argument('--repeat', type=int, default=5, help='Timed runs; the median is reported.')
+        parser.add_argument('--top', type=int, default=10, help='Packages and imports to list per phase.')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+        paths = options['paths'] or ['/api/books/']
+        report = {
+            'app': options['app'],
+            'paths': paths,
+            'runs': options['repeat'],
+            **self.profile(options['app'], paths, options['repeat'], options['top']),
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            self.write_report(report)
+
+    def run_child(self, app, paths, importtime):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE)
+        command = [sys.executable, *(['-X', 'importtime'] if importtime else []), '-m', 'books.startup', app, *paths]
+        start = time.perf_counter()
+        process = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+        if process.returncode:
+            raise CommandError(f'Profiling run failed:\n{process.stderr}')
+        phases, errors = startup.parse_importtime(process.stderr.splitlines())
+        if errors:
+            raise CommandError('; '.join(errors))
+        return [phase for phase in phases if not phase['phase'].startswith('_')], elapsed
+
+    def profile(self, app, paths, repeat, top):
+        # -X importtime slows imports down, so the timings come from separate runs.
+        timed = [self.run_child(app, paths, importtime=False) for _ in range(repeat)]
+        traced, _ = self.run_child(app, paths, importtime=True)
+        phases = []
+        for index, phase in enumerate(traced):
+            phases.append({
+                'phase': phase['phase'],
+                'ms': round(statistics.median(run[index]['seconds'] for run, _ in timed) * 1000, 2),
+                **startup.summarize_imports(phase['imports'], top),
+            })
+        return {
+            'phases': phases,
+            'boot_ms': round(sum(phase['ms'] for phase in phases), 2),
+            'process_ms': round(statistics.median(elapsed for _, elapsed in timed) * 1000, 2),
+        }
+
+    def write_report(self, report):
+        phases = report['phases']
+        rows = [(phase['phase'], phase['ms']) for phase in phases]
+        rows.append(('boot + first requests', report['boot_ms']))
+        rows.append(('whole process', report['process_ms']))
+        width = max(len(name) for name, _ in rows)
+        self.stdout.write(f"Cold start of the {report['app'].upper()} app, median of {report['runs']} runs (ms)")
+        for name, value in rows:
+            self.stdout.write(f'{name:<{width}}{value:>12.1f}')
+
+        for phase in phases:
+            self.stdout.write('')
+            self.stdout.write(f"{phase['phase']}: {phase['import_ms']:.1f} ms importing {phase['modules']} modules")
+            if not phase['modules']:
+                continue
+            self.stdout.write('  by package (self time):')
+            for entry in phase['packages']:
+                self.stdout.write(f"    {entry['ms']:>8.1f}  {entry['package']}")
+            self.stdout.write('  imported by this phase (including dependencies):')
+            for entry in phase['imported_by_phase']:
+                self.stdout.write(f"    {entry['ms']:>8.1f}  {entry['module']}")
@@ -0,0 +1,80 @@
+import json
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from books.slowlog import normalize_sql
+
+
+class Command(BaseCommand):
+    help = 'Summarize the slow query log, grouping entries by query fingerprint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Log file (defaults to BOOKS_SLOW_QUERY_LOG). Rotated files are included.')
+        parser.add_argument('--limit', type=int, default=20, help='Number of fingerprints to show.')
+        parser.add_argument('--sort', choices=['total', 'count', 'max'], default='total')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON.')
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'BOOKS_SLOW_QUERY_LOG', None)
+        if not path:
+            raise CommandError('No log file: pass --path or set BOOKS_SLOW_QUERY_LOG.')
+        path = Path(path)
+        files = [path, *sorted(path.parent.glob(f'{path.name}.*'))]
+        groups = {}
+        for entry in self.read_entries(files):
+            group = groups.get(entry['fingerprint'])
+            if group is None:
+                group = groups[entry['fingerprint']] = {
+                    'fingerprint': entry['fingerprint'],
+                    'sql': normalize_sql(entry['sql']),
+                    'count': 0,
+                    'total_ms': 0.0,
+                    'max_ms': 0.0,
+                    'views': Counter(),
+                    'slowest': entry,
+                }
+            group['count'] += 1
+            group['total_ms'] += entry['duration_ms']
+            group['views'][entry.get('action') or entry.get('view') or '-'] += 1
+            if entry['duration_ms'] >= group['max_ms']:
+                group['max_ms'] = entry['duration_ms']
+                group['slowest'] = entry
+
+        key = {'total': 'total_ms', 'count': 'count', 'max': 'max_ms'}[options['sort']]
+        report = sorted(groups.values(), key=lambda group: group[key], reverse=True)[:options['limit']]
+        for group in report:
+            group['avg_ms'] = group['total_ms'] / group['count']
+            group['views'] = dict(group['views'].most_common())
+            slowest = group.pop('slowest')
+            group['example'] = {name: slowest.get(name) for name in ('params', 'path', 'plan', 'duration_ms')}
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        if not report:
+            self.stdout.write('No slow queries logged.')
+        for group in report:
+            self.stdout.write(
+                f"{group['fingerprint']}  count={group['count']}  total={group['total_ms']:.1f}ms  "
+                f"avg={group['avg_ms']:.1f}ms  max={group['max_ms']:.1f}ms"
+            )
+            self.stdout.write(f"  {group['sql']}")
+            self.stdout.write(f"  views: {', '.join(f'{view} ({count})' for view, count in group['views'].items())}")
+            self.stdout.write(f"  slowest params: {json.dumps(group['example']['params'])}")
+            for row in group['example']['plan'] or []:
+                self.stdout.write(f'    {row[-1]}')
+            self.stdout.write('')
+
+    def read_entries(self, files):
+        for file in files:
+            if not file.exists():
+                continue
+            with file.open(encoding='utf-8') as lines:
+                for line in lines:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
@@ -0,0 +1,79 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import RequestFactory
+from django.urls import Resolver404, resolve
+
+from books.materialized import hit_counter
+from books.traffic import top_keys
+from books.utils import default_host
+
+
+class Command(BaseCommand):
+    help = 'Replay the most frequent recorded API requests through the views to warm result caches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=50, help='Number of most frequent request keys to replay.')
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--budget', type=float, default=30.0, help='Stop starting new requests after this many seconds.')
+        parser.add_argument('--host', default=None, help='Host header for the replayed requests.')
+        parser.add_argument('--dry-run', action='store_true', help='List the keys without replaying them.')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BOOKS_TRAFFIC_DIR', None):
+            raise CommandError('BOOKS_TRAFFIC_DIR is not set, so no traffic has been recorded.')
+        keys = top_keys(options['top'])
+        if options['dry_run']:
+            for key, count in keys:
+                self.stdout.write(f'{count:>8}  {key}')
+            return
+
+        self.factory = RequestFactory(HTTP_HOST=options['host'] or default_host(), HTTP_ACCEPT='application/json')
+        self.deadline = time.monotonic() + options['budget']
+        self.in_worker_threads = options['threads'] > 1
+        start = time.monotonic()
+        if self.in_worker_threads:
+            with ThreadPoolExecutor(max_workers=options['threads']) as executor:
+                outcomes = list(executor.map(self.replay, [key for key, _ in keys]))
+        else:
+            outcomes = [self.replay(key) for key, _ in keys]
+        elapsed = time.monotonic() - start
+
+        warmed = outcomes.count('ok')
+        skipped = outcomes.count('skipped')
+        for key, outcome in zip((key for key, _ in keys), outcomes):
+            if outcome not in ('ok', 'skipped'):
+                self.stderr.write(f'{key}: {outcome}')
+        self.stdout.write(
+            f'Warmed {warmed}/{len(keys)} request keys in {elapsed:.2f}s '
+            f'({skipped} skipped over budget, {len(keys) - warmed - skipped} failed).'
+        )
+
+    def replay(self, key):
+        if time.monotonic() >= self.deadline:
+            return 'skipped'
+        try:
+            request = self.factory.get(key)
+            match = resolve(request.path_info)
+            request.resolver_match = match
+            # The keys were recorded from real traffic, so their results are worth materializing now.
+            with hit_counter.hot():
+                response = match.func(request, *match.args, **match.kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            response.close()
+            return 'ok' if response.status_code < 400 else f'HTTP {response.status_code}'
+        except Resolver404:
+            return 'no longer routed'
+        except Exception as exc:
+            return f'{type(exc).__name__}: {exc}'
+        finally:
+            if self.in_worker_threads:
+                # Each worker thread opened its own connection.
+                connections.close_all()
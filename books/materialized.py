@@ -0,0 +1,266 @@
+"""
+Materialized results for the ``by_genre`` and ``expensive_books`` actions.
+
+Once a parameter value has been requested ``BOOKS_MATERIALIZED_MIN_HITS``
+times in a process, every matching book is stored, already serialized, as
+``MaterializedResultRow`` rows in title order. Later requests read the rows
+through an index instead of scanning ``books_book`` and re-serializing each
+book. The signal handlers in ``books.signals`` call ``refresh_books()``
+whenever a book or its authors change. That update only touches the rows of
+the changed books.
+
+At most ``BOOKS_MATERIALIZED_MAX_RESULTS`` results are kept: building a new
+one evicts the least recently used, results unused for
+``BOOKS_MATERIALIZED_TTL`` seconds, and results rendered by a different
+version of ``BookSerializer``.
+
+A result is built in batches, each in its own short transaction, so a broad
+value doesn't hold SQLite's write lock while the whole catalog is serialized.
+It is served once complete.
+"""
+import contextlib
+import functools
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from .models import Book, ChangeLogEntry, MaterializedResult, MaterializedResultRow
+from .serializers import BookSerializer
+from .utils import ascii_lower
+
+# Bump to discard stored payloads when rendering changes in a way the serializer's repr doesn't show.
+PAYLOAD_VERSION = 1
+# How many not yet materialized values each process counts requests for.
+PENDING_VALUES = 1000
+# last_used_at is written at most this often per result.
+TOUCH_INTERVAL = timedelta(minutes=1)
+# Books read, rendered and inserted per transaction while building a result.
+BUILD_BATCH = 500
+# An incomplete result this old was left behind by a build that failed.
+BUILD_TIMEOUT = timedelta(minutes=10)
+
+
+class MaterializedAction:
+    def __init__(self, normalize, lookup, matches):
+        self.normalize = normalize
+        self.lookup = lookup
+        self.matches = matches
+
+
+def _normalize_price(value):
+    try:
+        price = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    if not price.is_finite():
+        return None
+    return format(price.normalize(), 'f')
+
+
+def _normalize_genre(value):
+    # An empty genre matches the whole catalog; that's not worth a copy.
+    return ascii_lower(value) or None
+
+
+ACTIONS = {
+    'by_genre': MaterializedAction(
+        normalize=_normalize_genre,
+        lookup=lambda param: {'genre__icontains': param},
+        matches=lambda book, param: param in ascii_lower(book.genre),
+    ),
+    'expensive_books': MaterializedAction(
+        normalize=_normalize_price,
+        lookup=lambda param: {'price__gte': param},
+        matches=lambda book, param: book.price is not None and book.price >= Decimal(param),
+    ),
+}
+
+
+def render_book(book):
+    return JSONRenderer().render(BookSerializer(book).data).decode()
+
+
+@functools.cache
+def payload_version():
+    """Identifies the serializer the payloads were rendered with."""
+    digest = hashlib.sha1(repr(BookSerializer()).encode()).hexdigest()
+    return f'{PAYLOAD_VERSION}:{digest}'
+
+
+class HitCounter:
+    """Counts requests for values that aren't materialized yet, in this process only."""
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._hits = OrderedDict()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def hot(self):
+        """Treat every value requested by this thread inside the block as hot, e.g. when warming caches."""
+        self._local.hot = True
+        try:
+            yield
+        finally:
+            self._local.hot = False
+
+    def hit(self, key):
+        """Count a request for ``key``; return True once it has had enough to be materialized."""
+        if getattr(self._local, 'hot', False):
+            return True
+        with self._lock:
+            hits = self._hits.pop(key, 0) + 1
+            if hits >= getattr(settings, 'BOOKS_MATERIALIZED_MIN_HITS', 3):
+                return True
+            self._hits[key] = hits
+            while len(self._hits) > self.size:
+                self._hits.popitem(last=False)
+            return False
+
+    def clear(self):
+        with self._lock:
+            self._hits.clear()
+
+
+hit_counter = HitCounter(PENDING_VALUES)
+
+
+def evict(keep):
+    """Delete stale results and all but the ``keep`` most recently used ones."""
+    ttl = timedelta(seconds=getattr(settings, 'BOOKS_MATERIALIZED_TTL', 86400))
+    now = timezone.now()
+    MaterializedResult.objects.exclude(version=payload_version()).delete()
+    MaterializedResult.objects.filter(last_used_at__lt=now - ttl).delete()
+    MaterializedResult.objects.filter(complete=False, created_at__lt=now - BUILD_TIMEOUT).delete()
+    stale = list(MaterializedResult.objects.order_by('-last_used_at', '-pk').values_list('pk', flat=True)[keep:])
+    if stale:
+        MaterializedResult.objects.filter(pk__in=stale).delete()
+
+
+def get_result(action, value):
+    """
+    Return the MaterializedResult for ``action`` and a raw parameter value,
+    building it once the value is requested often enough. Returns None when
+    the value isn't (yet) materialized.
+    """
+    materialized = ACTIONS[action]
+    param = materialized.normalize(value)
+    if param is None:
+        return None
+    result = MaterializedResult.objects.filter(action=action, param=param, version=payload_version()).first()
+    if result is not None:
+        if not result.complete:
+            # Another request is building it.
+            return None
+        now = timezone.now()
+        if result.last_used_at < now - TOUCH_INTERVAL:
+            MaterializedResult.objects.filter(pk=result.pk).update(last_used_at=now)
+        return result
+    max_results = getattr(settings, 'BOOKS_MATERIALIZED_MAX_RESULTS', 100)
+    if max_results < 1 or not hit_counter.hit((action, param)):
+        return None
+    try:
+        with transaction.atomic():
+            evict(max_results - 1)
+            result = MaterializedResult.objects.create(action=action, param=param, version=payload_version())
+    except IntegrityError:
+        # Another request started building it first.
+        return None
+    if not build(result, materialized.lookup(param)):
+        return None
+    return result
+
+
+def build(result, lookup):
+    """
+    Add a row for every book matching ``lookup`` to ``result``, then mark it
+    complete. refresh_books() already maintains the result while it's built;
+    books read before a concurrent change are refreshed from the change log
+    at the end. Returns False if the result was evicted in the meantime.
+    """
+    cursor = ChangeLogEntry.objects.aggregate(cursor=Max('pk'))['cursor'] or 0
+    books = Book.objects.filter(**lookup).order_by('pk').prefetch_related('authors')
+    last = 0
+    while batch := list(books.filter(pk__gt=last)[:BUILD_BATCH]):
+        try:
+            # Rows refresh_books() added in the meantime are newer; keep them.
+            MaterializedResultRow.objects.bulk_create(
+                [
+                    MaterializedResultRow(result=result, book=book, sort_key=book.title, payload=render_book(book))
+                    for book in batch
+                ],
+                ignore_conflicts=True,
+            )
+        except IntegrityError:
+            if not MaterializedResult.objects.filter(pk=result.pk).exists():
+                return False
+            # A book in the batch was deleted after it was read; read the batch again.
+            continue
+        last = batch[-1].pk
+    changes = ChangeLogEntry.objects.filter(pk__gt=cursor)
+    changed = set(changes.filter(model='book').values_list('object_id', flat=True))
+    authors = changes.filter(model='author').values_list('object_id', flat=True)
+    changed.update(Book.objects.filter(authors__in=authors).values_list('pk', flat=True))
+    refresh_books(changed)
+    result.complete = True
+    return MaterializedResult.objects.filter(pk=result.pk).update(complete=True) == 1
+
+
+def ordered_payloads(result):
+    return result.rows.order_by('sort_key', 'book_id').values_list('payload', flat=True)
+
+
+def stream_json_array(payloads, buffer_size=65536):
+    """Join serialized payloads into a JSON array, yielding it in chunks."""
+    chunk = ['[']
+    size = 1
+    for i, payload in enumerate(payloads):
+        if i:
+            chunk.append(',')
+        chunk.append(payload)
+        size += len(payload) + 1
+        if size >= buffer_size:
+            yield ''.join(chunk)
+            chunk, size = [], 0
+    chunk.append(']')
+    yield ''.join(chunk)
+
+
+def refresh_books(book_ids):
+    """Bring the rows of ``book_ids`` up to date in every current materialized result."""
+    results = list(MaterializedResult.objects.filter(version=payload_version()))
+    if not results:
+        return
+    book_ids = set(book_ids)
+    if not book_ids:
+        return
+    books = Book.objects.filter(pk__in=book_ids).prefetch_related('authors')
+    existing = {}
+    for result_id, book_id in MaterializedResultRow.objects.filter(book_id__in=book_ids).values_list('result_id', 'book_id'):
+        existing.setdefault(book_id, set()).add(result_id)
+    new_rows = []
+    for book in books:
+        matching = {result.pk for result in results if ACTIONS[result.action].matches(book, result.param)}
+        current = existing.get(book.pk, set())
+        rows = MaterializedResultRow.objects.filter(book=book)
+        if current - matching:
+            rows.filter(result_id__in=current - matching).delete()
+        if not matching:
+            continue
+        payload = render_book(book)
+        if current & matching:
+            rows.filter(result_id__in=current & matching).update(sort_key=book.title, payload=payload)
+        new_rows.extend(
+            MaterializedResultRow(result_id=result_id, book=book, sort_key=book.title, payload=payload)
+            for result_id in matching - current
+        )
+    MaterializedResultRow.objects.bulk_create(new_rows)
@@ -0,0 +1,452 @@
+"""
+An in-memory index of the catalog that answers ``BookViewSet`` list requests
+without querying ``books_book``. It is off unless ``BOOKS_MEMORY_INDEX`` is set.
+
+Each process loads the books, authors and the authors through table into
+columns indexed by a row slot:
+
+* prices as fixed-point cents in an ``array('q')``, with ``NULL_PRICE`` for no price,
+* publication dates as ordinals (0 for none),
+* genres interned into a code per distinct genre,
+* slots sorted by ``(title, id)``, for the default ordering,
+* author id -> sorted ``array('q')`` of the slots of that author's books.
+
+``query()`` evaluates ``BookFilter``'s parameters and the ``ordering``
+parameter the way the ORM does on SQLite: ``icontains`` only folds ASCII
+case, and nulls sort first. Ties are broken by id. Parameters it can't
+evaluate, including values the filterset would reject, make it return
+``None`` so the view falls back to the ORM.
+
+The index stays current by reading the change log (``books.changes``) at
+most every ``BOOKS_MEMORY_INDEX_REFRESH_INTERVAL`` seconds. Only the changed
+books and authors are reloaded.
+"""
+import bisect
+import math
+import os
+import re
+import threading
+import time
+from array import array
+from datetime import date
+from decimal import Decimal
+
+from django.conf import settings
+
+from .isbn import normalize_isbn
+from .models import Author, Book, ChangeLogEntry
+from .utils import ascii_lower
+
+BOOK_FIELDS = ['id', 'title', 'isbn', 'publication_date', 'price', 'genre']
+NULL_PRICE = -2 ** 63
+# Plain decimals only; anything else is left to the filterset's form field.
+_NUMBER = re.compile(r'-?\d+(\.\d+)?\Z')
+
+
+def _to_cents(price):
+    return NULL_PRICE if price is None else int(price.scaleb(2))
+
+
+def _parse_text(params, name):
+    value = params.get(name)
+    if value is None:
+        return None
+    if '\x00' in value:
+        return False
+    return ascii_lower(value.strip()) or None
+
+
+def _parse_number(params, name):
+    value = params.get(name)
+    if not value:
+        return None
+    if not _NUMBER.match(value):
+        return False
+    return Decimal(value)
+
+
+def _parse_ids(params, name):
+    values = params.getlist(name)
+    if not all(value.isdigit() and value.isascii() for value in values):
+        return False
+    return list(dict.fromkeys(int(value) for value in values)) or None
+
+
+def parse_filters(params):
+    """
+    Return the ``BookFilter`` parameters in ``params`` as a dict, or ``None``
+    if one of them may not be valid.
+    """
+    filters = {
+        'title': _parse_text(params, 'title'),
+        'genre': _parse_text(params, 'genre'),
+        'min_price': _parse_number(params, 'min_price'),
+        'max_price': _parse_number(params, 'max_price'),
+        'authors': _parse_ids(params, 'authors'),
+        'all_authors': _parse_ids(params, 'all_authors'),
+    }
+    isbn = params.get('isbn')
+    if isbn and '\x00' in isbn:
+        return None
+    filters['isbn'] = isbn.strip() if isbn else None
+    if any(value is False for value in filters.values()):
+        return None
+    return {name: value for name, value in filters.items() if value is not None and value != ''}
+
+
+def parse_ordering(params, ordering_fields, default):
+    """The ordering ``OrderingFilter`` would apply, as a tuple of terms."""
+    terms = [term.strip() for term in params.get('ordering', '').split(',')]
+    terms = [term for term in terms if (term[1:] if term.startswith('-') else term) in ordering_fields]
+    return tuple(terms or default)
+
+
+def _intersect(a, b):
+    result = array('q')
+    low = 0
+    for slot in a:
+        low = bisect.bisect_left(b, slot, low)
+        if low == len(b):
+            break
+        if b[low] == slot:
+            result.append(slot)
+    return result
+
+
+class IndexResult:
+    """
+    The ordered slots matching a query; indexing returns ``Book`` instances.
+    It keeps the generation its slots belong to, so it stays valid after a reload.
+    """
+
+    def __init__(self, index, generation, slots):
+        self.index = index
+        self.generation = generation
+        self.slots = slots
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, item):
+        slots = self.slots[item] if isinstance(item, slice) else [self.slots[item]]
+        with self.index._lock:
+            books = self.generation.books(slots)
+        return books if isinstance(item, slice) else books[0]
+
+
+class Generation:
+    """
+    The columns of one full load. Refreshes update a generation in place, but
+    a slot always holds the same book: deleted books keep their values and are
+    only unreachable. Compaction builds a new generation instead.
+    """
+
+    # Reload once more than half of this many slots are deleted.
+    compact_after = 1000
+
+    def __init__(self):
+        self.ids = array('q')
+        self.prices = array('q')
+        self.dates = array('l')
+        self.genre_codes = array('l')
+        self.alive = bytearray()
+        self.titles = []
+        self.title_keys = []
+        self.isbns = []
+        self.book_authors = []
+        self.genres = []
+        self.genre_lookup = {}
+        self.slots = {}
+        self.isbn_slots = {}
+        self.author_names = {}
+        self.postings = {}
+        self.title_order = array('q')
+        self.orders = {}
+
+    @classmethod
+    def load(cls):
+        generation = cls()
+        generation.author_names = dict(Author.objects.values_list('id', 'name'))
+        links = {}
+        through = Book.authors.through.objects.values_list('book_id', 'author_id')
+        for book_id, author_id in through.iterator(chunk_size=2000):
+            links.setdefault(book_id, []).append(author_id)
+        for row in Book.objects.order_by('pk').values_list(*BOOK_FIELDS).iterator(chunk_size=2000):
+            slot = generation._append(row, links.get(row[0], ()))
+            for author_id in generation.book_authors[slot]:
+                generation.postings.setdefault(author_id, array('q')).append(slot)
+        generation.title_order = array('q', sorted(range(len(generation.ids)), key=generation._title_key))
+        return generation
+
+    def needs_compaction(self):
+        return len(self.alive) > self.compact_after and self.alive.count(0) > len(self.alive) // 2
+
+    def update_authors(self, names, author_ids):
+        for author_id in author_ids:
+            if author_id in names:
+                self.author_names[author_id] = names[author_id]
+            else:
+                self.author_names.pop(author_id, None)
+
+    def update_books(self, rows, links, book_ids):
+        # Readers may still hold the previous orderings and postings, so copy them before changing them.
+        self.title_order = array('q', self.title_order)
+        copied = set()
+        for book_id in sorted(book_ids):
+            if book_id in rows:
+                self._upsert(rows[book_id], links.get(book_id, ()), copied)
+            else:
+                self._remove(book_id, copied)
+        self.orders = {}
+
+    def _title_key(self, slot):
+        return self.titles[slot], self.ids[slot]
+
+    def _set_columns(self, slot, row):
+        _, title, isbn, publication_date, price, genre = row
+        self.titles[slot] = title
+        self.title_keys[slot] = ascii_lower(title)
+        self.isbns[slot] = isbn
+        self.dates[slot] = publication_date.toordinal() if publication_date else 0
+        self.prices[slot] = _to_cents(price)
+        code = self.genre_lookup.get(genre)
+        if code is None:
+            code = self.genre_lookup[genre] = len(self.genres)
+            self.genres.append(genre)
+        self.genre_codes[slot] = code
+        if isbn is not None:
+            self.isbn_slots[isbn] = slot
+
+    def _append(self, row, author_ids):
+        slot = len(self.ids)
+        self.ids.append(row[0])
+        self.prices.append(NULL_PRICE)
+        self.dates.append(0)
+        self.genre_codes.append(0)
+        self.alive.append(1)
+        self.titles.append(None)
+        self.title_keys.append(None)
+        self.isbns.append(None)
+        self.book_authors.append(tuple(sorted(author_ids)))
+        self._set_columns(slot, row)
+        self.slots[row[0]] = slot
+        return slot
+
+    def _posting(self, author_id, copied):
+        if author_id not in copied:
+            copied.add(author_id)
+            self.postings[author_id] = array('q', self.postings.get(author_id, ()))
+        return self.postings[author_id]
+
+    def _unlink(self, slot, author_ids, copied):
+        for author_id in author_ids:
+            posting = self._posting(author_id, copied)
+            del posting[bisect.bisect_left(posting, slot)]
+            if not posting:
+                del self.postings[author_id]
+                copied.discard(author_id)
+
+    def _link(self, slot, author_ids, copied):
+        for author_id in author_ids:
+            bisect.insort(self._posting(author_id, copied), slot)
+
+    def _remove_from_title_order(self, slot):
+        del self.title_order[bisect.bisect_left(self.title_order, self._title_key(slot), key=self._title_key)]
+
+    def _forget_isbn(self, slot):
+        if self.isbns[slot] is not None and self.isbn_slots.get(self.isbns[slot]) == slot:
+            del self.isbn_slots[self.isbns[slot]]
+
+    def _upsert(self, row, author_ids, copied):
+        author_ids = tuple(sorted(author_ids))
+        slot = self.slots.get(row[0])
+        if slot is None:
+            slot = self._append(row, ())
+            old_ids = ()
+        else:
+            old_ids = self.book_authors[slot]
+            self._remove_from_title_order(slot)
+            self._forget_isbn(slot)
+            self._set_columns(slot, row)
+        bisect.insort(self.title_order, slot, key=self._title_key)
+        self._unlink(slot, set(old_ids) - set(author_ids), copied)
+        self._link(slot, set(author_ids) - set(old_ids), copied)
+        self.book_authors[slot] = author_ids
+
+    def _remove(self, book_id, copied):
+        slot = self.slots.pop(book_id, None)
+        if slot is None:
+            return
+        self.alive[slot] = 0
+        self._remove_from_title_order(slot)
+        self._forget_isbn(slot)
+        self._unlink(slot, self.book_authors[slot], copied)
+
+    def query(self, filters, ordering):
+        """The ordered slots of the books matching ``filters``."""
+        if not filters:
+            return self._full_order(ordering)
+        slots = self._select(filters)
+        if len(slots) * 8 > len(self.slots):
+            # Cheaper to walk the cached full ordering than to sort many rows.
+            mask = bytearray(len(self.ids))
+            for slot in slots:
+                mask[slot] = 1
+            return [slot for slot in self._full_order(ordering) if mask[slot]]
+        slots.sort(key=self.ids.__getitem__)
+        for term in reversed(ordering):
+            slots.sort(key=self._sort_key(term.lstrip('-')), reverse=term.startswith('-'))
+        return slots
+
+    def _sort_key(self, field):
+        if field == 'title':
+            return self.titles.__getitem__
+        if field == 'price':
+            return self.prices.__getitem__
+        if field == 'publication_date':
+            return self.dates.__getitem__
+        raise ValueError(f'Unsupported ordering: {field}')
+
+    def _full_order(self, ordering):
+        if ordering == ('title',):
+            return self.title_order
+        order = self.orders.get(ordering)
+        if order is None:
+            slots = sorted(self.slots.values(), key=self.ids.__getitem__)
+            for term in reversed(ordering):
+                slots.sort(key=self._sort_key(term.lstrip('-')), reverse=term.startswith('-'))
+            order = self.orders[ordering] = array('q', slots)
+        return order
+
+    def _select(self, filters):
+        """The slots of the matching books, in no particular order."""
+        # Candidates come from the ISBN map and the postings, as sorted slots.
+        candidates = None
+        if 'isbn' in filters:
+            slot = self.isbn_slots.get(normalize_isbn(filters['isbn']))
+            candidates = [] if slot is None else [slot]
+        if 'authors' in filters:
+            any_slots = sorted({slot for author_id in filters['authors'] for slot in self.postings.get(author_id, ())})
+            candidates = any_slots if candidates is None else _intersect(candidates, any_slots)
+        for author_id in filters.get('all_authors', ()):
+            posting = self.postings.get(author_id, array('q'))
+            candidates = posting if candidates is None else _intersect(candidates, posting)
+        if candidates is None:
+            candidates = self.slots.values()
+
+        slots = candidates
+        if 'title' in filters:
+            needle, keys = filters['title'], self.title_keys
+            slots = [slot for slot in slots if needle in keys[slot]]
+        if 'genre' in filters:
+            codes = {code for code, genre in enumerate(self.genres) if filters['genre'] in ascii_lower(genre)}
+            genre_codes = self.genre_codes
+            slots = [slot for slot in slots if genre_codes[slot] in codes]
+        if 'min_price' in filters or 'max_price' in filters:
+            low = math.ceil(filters['min_price'] * 100) if 'min_price' in filters else NULL_PRICE + 1
+            high = math.floor(filters['max_price'] * 100) if 'max_price' in filters else 2 ** 63 - 1
+            prices = self.prices
+            slots = [slot for slot in slots if low <= prices[slot] <= high]
+        return list(slots)
+
+    def books(self, slots):
+        """Unsaved-looking ``Book`` instances for ``slots``, with their authors prefetched."""
+        books = []
+        for slot in slots:
+            price = self.prices[slot]
+            book = Book.from_db(None, BOOK_FIELDS, (
+                self.ids[slot],
+                self.titles[slot],
+                self.isbns[slot],
+                date.fromordinal(self.dates[slot]) if self.dates[slot] else None,
+                None if price == NULL_PRICE else Decimal(price).scaleb(-2),
+                self.genres[self.genre_codes[slot]],
+            ))
+            authors = sorted(
+                (self.author_names[pk], pk) for pk in self.book_authors[slot] if pk in self.author_names
+            )
+            queryset = Author.objects.filter(pk__in=[pk for _, pk in authors])
+            queryset._result_cache = [Author.from_db(None, ['id', 'name'], (pk, name)) for name, pk in authors]
+            queryset._prefetch_done = True
+            book._prefetched_objects_cache = {'authors': queryset}
+            books.append(book)
+        return books
+
+
+class BookIndex:
+    def __init__(self):
+        self._reset_lock()
+        self.clear()
+        os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.RLock()
+
+    def clear(self):
+        """Drop the index; the next query loads it again."""
+        with self._lock:
+            self._cursor = None
+            self._checked_at = 0.0
+            self._generation = None
+            self.loads = 0
+
+    def load(self):
+        """Load the whole catalog into a new generation."""
+        # Read the cursor first: changes made while loading are applied again by the next refresh.
+        cursor = ChangeLogEntry.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        self._generation = Generation.load()
+        self._cursor = cursor
+        self._checked_at = time.monotonic()
+        self.loads += 1
+
+    def refresh(self):
+        """Apply the changes logged since the last load or refresh."""
+        if self._generation is None:
+            self.load()
+            return
+        now = time.monotonic()
+        if now - self._checked_at < getattr(settings, 'BOOKS_MEMORY_INDEX_REFRESH_INTERVAL', 1.0):
+            return
+        self._checked_at = now
+        entries = list(
+            ChangeLogEntry.objects.filter(pk__gt=self._cursor).order_by('pk').values_list('pk', 'model', 'object_id')
+        )
+        if not entries:
+            return
+        generation = self._generation
+        book_ids = {object_id for _, model, object_id in entries if model == 'book'}
+        author_ids = {object_id for _, model, object_id in entries if model == 'author'}
+        if author_ids:
+            generation.update_authors(dict(Author.objects.filter(pk__in=author_ids).values_list('id', 'name')), author_ids)
+        if book_ids:
+            rows = {row[0]: row for row in Book.objects.filter(pk__in=book_ids).values_list(*BOOK_FIELDS)}
+            links = {}
+            through = Book.authors.through.objects.filter(book_id__in=list(rows)).values_list('book_id', 'author_id')
+            for book_id, author_id in through:
+                links.setdefault(book_id, []).append(author_id)
+            generation.update_books(rows, links, book_ids)
+        self._cursor = entries[-1][0]
+        if generation.needs_compaction():
+            self.load()
+
+    def query(self, params, ordering_fields, default_ordering):
+        """
+        Return the books matching ``params`` as an ``IndexResult`` in the
+        requested order, or ``None`` if the ORM has to answer the request.
+        """
+        filters = parse_filters(params)
+        if filters is None:
+            return None
+        ordering = parse_ordering(params, ordering_fields, default_ordering)
+        with self._lock:
+            self.refresh()
+            generation = self._generation
+            if any(
+                author_id not in generation.author_names
+                for name in ('authors', 'all_authors') for author_id in filters.get(name, ())
+            ):
+                return None
+            return IndexResult(self, generation, generation.query(filters, ordering))
+
+
+book_index = BookIndex()
@@ -0,0 +1,297 @@
+"""
+Low-overhead request metrics exported in the Prometheus text format.
+
+``MetricsMiddleware`` times every request and counts its queries and response
+bytes; ``books.views.InstrumentedViewMixin`` splits API requests into phases
+(filter, count, query, serialize, render). Observations go into in-process
+histograms. This module doesn't import DRF, so loading the middleware doesn't
+either. When ``BOOKS_METRICS_DIR`` is set, each worker process also writes its
+histograms to a file in that directory and ``/metrics`` sums them, so the
+endpoint reports the same totals whichever worker serves it. The files of
+workers that haven't written for ``BOOKS_METRICS_RETENTION`` seconds are folded
+into ``metrics-dead.json``, so the totals never go down.
+"""
+import atexit
+import bisect
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+DEAD_WORKERS = 'metrics-dead.json'
+
+METRICS = {
+    'books_request_duration_seconds': ('Total request latency.', DURATION_BUCKETS),
+    'books_request_phase_seconds': ('Time spent in each request phase, excluding nested phases.', DURATION_BUCKETS),
+    'books_request_queries': ('Database queries executed per request.', QUERY_BUCKETS),
+    'books_response_bytes': ('Response body size in bytes.', BYTES_BUCKETS),
+}
+
+
+class Registry:
+    """Thread-safe histograms keyed by ``(metric, labels)``."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        # A forked worker must not re-export the histograms of its parent.
+        self._data = {}
+        self._token = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._flushed_at = 0.0
+        # What the file held when last written, and the part of _data already
+        # folded into metrics-dead.json (which the file must leave out).
+        self._written = None
+        self._folded = {}
+
+    def observe(self, metric, labels, value):
+        buckets = METRICS[metric][1]
+        key = (metric, labels)
+        with self._lock:
+            series = self._data.get(key)
+            if series is None:
+                # One slot per bucket plus +Inf, then sum and count.
+                series = self._data[key] = [0] * (len(buckets) + 3)
+            series[bisect.bisect_left(buckets, value)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return [[metric, list(labels), list(series)] for (metric, labels), series in self._data.items()]
+
+    def unfolded(self, data):
+        """The series of ``data`` not yet counted in ``metrics-dead.json``."""
+        snapshot = []
+        for (metric, labels), series in data.items():
+            folded = self._folded.get((metric, labels))
+            if folded is not None:
+                series = [a - b for a, b in zip(series, folded)]
+            if series[-1]:
+                snapshot.append([metric, list(labels), series])
+        return snapshot
+
+    def flush(self, force=False):
+        """Write this process's histograms to ``BOOKS_METRICS_DIR``, at most once per interval."""
+        directory = getattr(settings, 'BOOKS_METRICS_DIR', None)
+        if not directory:
+            return
+        now = time.monotonic()
+        interval = getattr(settings, 'BOOKS_METRICS_FLUSH_INTERVAL', 1.0)
+        if not force and now - self._flushed_at < interval:
+            return
+        self._flushed_at = now
+        directory = Path(directory)
+        path = directory / f'metrics-{self._token}.json'
+        with self._flush_lock, locked(directory, fcntl.LOCK_SH):
+            with self._lock:
+                data = {key: list(series) for key, series in self._data.items()}
+            if self._written is not None and not path.exists():
+                # collect() folded our last write into metrics-dead.json while we were idle.
+                self._folded = self._written
+            write_snapshot(path, self.unfolded(data))
+            self._written = data
+
+    def collect(self):
+        """Return the series of every worker (or just this one without a shared directory)."""
+        directory = getattr(settings, 'BOOKS_METRICS_DIR', None)
+        if not directory:
+            return self.snapshot()
+        self.flush(force=True)
+        directory = Path(directory)
+        with locked(directory, fcntl.LOCK_EX):
+            fold_stale_snapshots(directory, getattr(settings, 'BOOKS_METRICS_RETENTION', 86400))
+            return merge_snapshots(read_snapshots(directory, 'metrics-*.json'))
+
+
+@contextmanager
+def locked(directory, operation):
+    """Hold ``flock(operation)`` on the directory's lock file: shared to write, exclusive to fold."""
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / 'metrics.lock', 'a') as lock:
+        fcntl.flock(lock, operation)
+        yield
+
+
+def fold_stale_snapshots(directory, max_age):
+    """
+    Add the files not rewritten in the last ``max_age`` seconds (exited or idle
+    workers) to ``metrics-dead.json`` and delete them. Call with the directory
+    locked exclusively.
+    """
+    cutoff = time.time() - max_age
+    stale = []
+    for path in directory.glob('metrics-*.json'):
+        if path.name == DEAD_WORKERS:
+            continue
+        try:
+            if path.stat().st_mtime < cutoff:
+                stale.append((path, json.loads(path.read_text())))
+        except (OSError, ValueError):
+            continue
+    if not stale:
+        return
+    dead = read_snapshots(directory, DEAD_WORKERS)
+    write_snapshot(directory / DEAD_WORKERS, merge_snapshots([*dead, *(snapshot for _, snapshot in stale)]))
+    for path, _ in stale:
+        path.unlink(missing_ok=True)
+
+
+def write_snapshot(path, snapshot):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f'.{path.name}.tmp')
+    tmp.write_text(json.dumps(snapshot))
+    os.replace(tmp, path)
+
+
+def read_snapshots(directory, pattern, max_age=None):
+    """
+    Load the snapshot files matching ``pattern``. Files not rewritten in the
+    last ``max_age`` seconds belong to workers that have exited; delete them.
+    """
+    snapshots = []
+    cutoff = time.time() - max_age if max_age is not None else None
+    for path in sorted(directory.glob(pattern)):
+        try:
+            if cutoff is not None and path.stat().st_mtime < cutoff:
+                path.unlink()
+                continue
+            snapshots.append(json.loads(path.read_text()))
+        except (OSError, ValueError):
+            # Removed or half-written by another process; it'll be there next scrape.
+            continue
+    return snapshots
+
+
+def merge_snapshots(snapshots):
+    merged = {}
+    for snapshot in snapshots:
+        for metric, labels, series in snapshot:
+            key = (metric, tuple(tuple(label) for label in labels))
+            total = merged.get(key)
+            if total is None:
+                merged[key] = list(series)
+            else:
+                merged[key] = [a + b for a, b in zip(total, series)]
+    return [[metric, list(labels), series] for (metric, labels), series in merged.items()]
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_prometheus(series):
+    by_metric = {}
+    for metric, labels, values in series:
+        by_metric.setdefault(metric, []).append((labels, values))
+    lines = []
+    for metric, (help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {metric} {help_text}')
+        lines.append(f'# TYPE {metric} histogram')
+        for labels, values in sorted(by_metric.get(metric, []), key=lambda item: [list(l) for l in item[0]]):
+            label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+            prefix = f'{label_text},' if label_text else ''
+            cumulative = 0
+            for bound, count in zip((*buckets, '+Inf'), values):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label_text}}} {_format_value(values[-2])}')
+            lines.append(f'{metric}_count{{{label_text}}} {values[-1]}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(
+        render_prometheus(registry.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
+
+
+class RequestTimer:
+    """Accumulates exclusive phase timings for a single request."""
+
+    def __init__(self):
+        self.phases = {}
+        self.queries = 0
+        self._stack = []
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self._stack.append(0.0)
+        try:
+            yield
+        finally:
+            nested = self._stack.pop()
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed - nested
+            if self._stack:
+                self._stack[-1] += elapsed
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+
+
+_current_timer = contextvars.ContextVar('books_request_timer', default=None)
+
+
+@contextmanager
+def phase(name):
+    """Attribute the enclosed time to ``name`` on the current request, if any."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+    else:
+        with timer.phase(name):
+            yield
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = RequestTimer()
+        token = _current_timer.set(timer)
+        start = time.perf_counter()
+        try:
+            with connection.execute_wrapper(timer):
+                response = self.get_response(request)
+        finally:
+            _current_timer.reset(token)
+        duration = time.perf_counter() - start
+
+        match = request.resolver_match
+        labels = (('method', request.method), ('view', match.view_name if match else 'unresolved'))
+        registry.observe('books_request_duration_seconds', labels, duration)
+        registry.observe('books_request_queries', labels, timer.queries)
+        if not response.streaming:
+            registry.observe('books_response_bytes', labels, len(response.content))
+        for name, elapsed in timer.phases.items():
+            registry.observe('books_request_phase_seconds', (*labels, ('phase', name)), elapsed)
+        registry.flush()
+        return response
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0002_remove_book_author_book_authors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MaterializedResult',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(max_length=50)),
+                ('param', models.CharField(max_length=200)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('action', 'param'), name='unique_materialized_result')],
+            },
+        ),
+        migrations.CreateModel(
+            name='MaterializedResultRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sort_key', models.CharField(max_length=200)),
+                ('payload', models.TextField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='books.book')),
+                ('result', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rows', to='books.materializedresult')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['result', 'sort_key', 'book'], name='materialized_row_order')],
+                'constraints': [models.UniqueConstraint(fields=('result', 'book'), name='unique_materialized_result_row')],
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:57
+
+import books.models
+from django.db import migrations
+
+from books.isbn import normalize_isbn
+
+
+def normalize_existing_isbns(apps, schema_editor):
+    Book = apps.get_model('books', 'Book')
+    changed = []
+    book_ids = {}
+    for book in Book.objects.exclude(isbn=None).only('isbn').order_by('pk'):
+        isbn = normalize_isbn(book.isbn) or None
+        if isbn is not None:
+            book_ids.setdefault(isbn, []).append(book.pk)
+        if isbn != book.isbn:
+            book.isbn = isbn
+            changed.append(book)
+    # The ISBN becomes unique below; say which books collide rather than fail halfway.
+    duplicates = {isbn: ids for isbn, ids in book_ids.items() if len(ids) > 1}
+    if duplicates:
+        raise RuntimeError(
+            'Books share an ISBN once normalized; merge them or clear the ISBN of all but one, then migrate '
+            'again: ' + '; '.join(f"{isbn}: books {', '.join(map(str, ids))}" for isbn, ids in sorted(duplicates.items()))
+        )
+    Book.objects.bulk_update(changed, ['isbn'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0003_materialized_results'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_existing_isbns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=books.models.ISBNField(blank=True, max_length=13, null=True, unique=True),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:16
+
+from django.db import migrations, models
+
+
+def log_existing_objects(apps, schema_editor):
+    # Replicas bootstrap by reading the feed from cursor 0, so it starts with the current catalog.
+    ChangeLogEntry = apps.get_model('books', 'ChangeLogEntry')
+    for model in ('author', 'book'):
+        ids = apps.get_model('books', model).objects.order_by('pk').values_list('pk', flat=True)
+        ChangeLogEntry.objects.bulk_create(
+            (ChangeLogEntry(model=model, object_id=pk, action='created') for pk in ids.iterator()),
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0004_normalize_isbn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model', models.CharField(max_length=20)),
+                ('object_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('created', 'Created'), ('updated', 'Updated'), ('deleted', 'Deleted')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='author',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(log_existing_objects, migrations.RunPython.noop),
+    ]
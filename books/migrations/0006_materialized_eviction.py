@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:35
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0005_change_log'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='materializedresult',
+            name='last_used_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='materializedresult',
+            name='version',
+            field=models.CharField(default='', max_length=64),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('books', '0006_materialized_eviction'),
+    ]
+
+    operations = [
+        # Existing results were built in a single transaction, so they are complete.
+        migrations.AddField(
+            model_name='materializedresult',
+            name='complete',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='materializedresult',
+            name='complete',
+            field=models.BooleanField(default=False),
+        ),
+    ]
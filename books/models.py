@@ -1,12 +1,46 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models.lookups import IContains
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+
+from .isbn import normalize_isbn
 
 # Create your models here.
 
+class ISBNField(models.CharField):
+    """
+    CharField for ISBNs. Values are normalized to ISBN-13 without hyphens on
+    save and in lookups, and blanks are stored as NULL so the field can be unique.
+    """
+
+    def get_prep_value(self, value):
+        return normalize_isbn(super().get_prep_value(value))
+
+    def pre_save(self, model_instance, add):
+        value = normalize_isbn(getattr(model_instance, self.attname)) or None
+        setattr(model_instance, self.attname, value)
+        return value
+
+
+@ISBNField.register_lookup
+class ISBNIContains(IContains):
+    """
+    ``icontains`` (used by the API's ``?search=``) on the normalized term, so a
+    hyphenated or ISBN-10 search still finds the stored ISBN-13.
+    """
+
+    def get_prep_lookup(self):
+        if isinstance(self.rhs, str):
+            return normalize_isbn(self.rhs)
+        return super().get_prep_lookup()
+
+
 class Author(models.Model):
     name = models.CharField(max_length=100)
     email = models.EmailField(blank=True, null=True)
     bio = models.TextField(blank=True)
     birth_date = models.DateField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.name
@@ -18,13 +52,98 @@ class Author(models.Model):
 class Book(models.Model):
     title = models.CharField(max_length=200)
     authors = models.ManyToManyField(Author, related_name='books')
-    isbn = models.CharField(max_length=13, blank=True, null=True)
+    isbn = ISBNField(max_length=13, blank=True, null=True, unique=True)
     publication_date = models.DateField(blank=True, null=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     genre = models.CharField(max_length=50, blank=True)
+    # Also bumped when the book's authors change.
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     
     def __str__(self):
         return self.title
+
+    def set_authors(self, authors):
+        """
+        Make ``authors`` the book's authors, inserting and deleting only the
+        through rows that change. Unlike ``book.authors.set()``, which sends
+        pre/post signals for the removal and for the addition, this sends a
+        single ``m2m_changed`` with ``action='post_set'`` and the ``added`` and
+        ``removed`` author ids, and only when something changed.
+        """
+        through = Book.authors.through
+        db = self._state.db
+        new_ids = {author.pk for author in authors}
+        with transaction.atomic(using=db, savepoint=False):
+            rows = through.objects.using(db).filter(book_id=self.pk)
+            current_ids = set(rows.values_list('author_id', flat=True))
+            added, removed = new_ids - current_ids, current_ids - new_ids
+            if removed:
+                rows.filter(author_id__in=removed).delete()
+            if added:
+                through.objects.using(db).bulk_create(
+                    [through(book_id=self.pk, author_id=pk) for pk in added], ignore_conflicts=True
+                )
+            getattr(self, '_prefetched_objects_cache', {}).pop('authors', None)
+            if added or removed:
+                m2m_changed.send(
+                    sender=through, instance=self, action='post_set', reverse=False, model=Author,
+                    pk_set=added | removed, using=db, added=added, removed=removed,
+                )
     
     class Meta:
         ordering = ['title']
+
+
+class MaterializedResult(models.Model):
+    """A precomputed result set for one parameter value of a BookViewSet action."""
+    action = models.CharField(max_length=50)
+    param = models.CharField(max_length=200)
+    # books.materialized.payload_version() when the rows were rendered.
+    version = models.CharField(max_length=64, default='')
+    # False while books.materialized.build() is still adding rows.
+    complete = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f'{self.action}({self.param})'
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['action', 'param'], name='unique_materialized_result'),
+        ]
+
+
+class MaterializedResultRow(models.Model):
+    """One serialized book in a MaterializedResult, kept in title order."""
+    result = models.ForeignKey(MaterializedResult, on_delete=models.CASCADE, related_name='rows')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    sort_key = models.CharField(max_length=200)
+    payload = models.TextField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['result', 'book'], name='unique_materialized_result_row'),
+        ]
+        indexes = [
+            models.Index(fields=['result', 'sort_key', 'book'], name='materialized_row_order'),
+        ]
+
+
+class ChangeLogEntry(models.Model):
+    """
+    One change to a Book or Author, including deletions and changes to a
+    book's authors. The auto-incrementing id is the cursor of the changes feed.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = [(CREATED, 'Created'), (UPDATED, 'Updated'), (DELETED, 'Deleted')]
+
+    model = models.CharField(max_length=20)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.action} {self.model} {self.object_id}'
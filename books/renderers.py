@@ -0,0 +1,160 @@
+import json
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ListSerializer, ManyRelatedField
+
+from .serializers import SparseFieldsetMixin
+
+
+class Columns(dict):
+    """
+    A column-oriented result set::
+
+        {"columns": {"id": [1, 2], "title": [...], "authors": [[0], [0, 1]]},
+         "tables": {"authors": {"id": [3, 4], "name": [...]}}}
+
+    To-many relations are stored once in ``tables`` and referenced by index.
+    """
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build columns from already serialized rows (the generic slow path)."""
+        names = list(rows[0]) if rows else []
+        columns, tables = {}, {}
+        for name in names:
+            values = [row.get(name) for row in rows]
+            if any(value and isinstance(value, list) and isinstance(value[0], dict) for value in values):
+                table = _Table()
+                values = [[table.add(json.dumps(item, sort_keys=True, default=str), item) for item in value or []]
+                          for value in values]
+                tables[name] = table.columns()
+            columns[name] = values
+        return cls(columns=columns, tables=tables)
+
+
+class _Table:
+    def __init__(self):
+        self.index = {}
+        self.rows = []
+
+    def add(self, key, row):
+        position = self.index.get(key)
+        if position is None:
+            position = self.index[key] = len(self.rows)
+            self.rows.append(row)
+        return position
+
+    def columns(self):
+        if not self.rows or not isinstance(self.rows[0], dict):
+            return self.rows
+        return {name: [row.get(name) for row in self.rows] for name in self.rows[0]}
+
+
+class ColumnarQuery:
+    """
+    Builds ``Columns`` for a serializer straight from ``values_list()`` rows,
+    without instantiating models or per-row dicts.
+
+    Only serializers made of plain model fields and many-to-many relations are
+    supported; check ``supported`` before using it.
+    """
+
+    def __init__(self, serializer, queryset):
+        self.serializer = serializer
+        self.queryset = queryset
+        self.scalars = []
+        self.relations = []
+        self.supported = True
+        opts = queryset.model._meta
+        for name, field in serializer.fields.items():
+            try:
+                model_field = opts.get_field(field.source)
+            except FieldDoesNotExist:
+                self.supported = False
+                return
+            if model_field.many_to_many and not model_field.auto_created:
+                self.relations.append((name, field, model_field))
+            elif model_field.concrete and not model_field.is_relation:
+                self.scalars.append((name, field, model_field.attname))
+            else:
+                self.supported = False
+                return
+
+    def values(self):
+        sources = [source for _, _, source in self.scalars]
+        return self.queryset.prefetch_related(None).values_list('pk', *sources)
+
+    def columns(self, rows):
+        rows = list(rows)
+        pks = [row[0] for row in rows]
+        columns = {}
+        for position, (name, field, _) in enumerate(self.scalars, start=1):
+            to_representation = field.to_representation
+            columns[name] = [
+                None if row[position] is None else to_representation(row[position])
+                for row in rows
+            ]
+        tables = {}
+        for name, field, model_field in self.relations:
+            columns[name], tables[name] = self._relation(pks, field, model_field)
+        # Keep the serializer's field order.
+        columns = {name: columns[name] for name in self.serializer.fields}
+        return Columns(columns=columns, tables=tables)
+
+    def _relation(self, pks, field, model_field):
+        source_name = model_field.m2m_field_name()
+        target_name = model_field.m2m_reverse_field_name()
+        related_model = model_field.related_model
+        ordering = [
+            f'-{target_name}__{order[1:]}' if order.startswith('-') else f'{target_name}__{order}'
+            for order in related_model._meta.ordering
+        ]
+        links = (
+            model_field.remote_field.through._default_manager
+            .filter(**{f'{source_name}__in': pks})
+            .order_by(*ordering)
+            .values_list(f'{source_name}_id', f'{target_name}_id')
+        )
+        by_row = {pk: [] for pk in pks}
+        related_pks = []
+        for pk, related_pk in links:
+            by_row[pk].append(related_pk)
+            related_pks.append(related_pk)
+
+        if isinstance(field, ListSerializer):
+            child = field.child
+        elif isinstance(field, ManyRelatedField):
+            child = field.child_relation
+        else:
+            child = field
+        related = related_model._default_manager.filter(pk__in=set(related_pks))
+        if isinstance(child, SparseFieldsetMixin):
+            related = child.prune_queryset(related)
+
+        table = _Table()
+        positions = {obj.pk: table.add(obj.pk, child.to_representation(obj)) for obj in related}
+        column = [[positions[related_pk] for related_pk in by_row[pk]] for pk in pks]
+        return column, table.columns()
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    Opt-in compact renderer for list responses, selected with
+    ``Accept: application/vnd.books.columnar+json`` or ``?format=columnar``.
+
+    Non-list payloads (detail views, errors) are rendered as plain JSON.
+    """
+    media_type = 'application/vnd.books.columnar+json'
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict) and _is_rows(data.get('results')):
+            data = {**data, 'results': Columns.from_rows(data['results'])}
+        elif _is_rows(data):
+            data = Columns.from_rows(data)
+        return super().render(data, accepted_media_type, renderer_context)
+
+
+def _is_rows(data):
+    return isinstance(data, list) and all(isinstance(row, dict) for row in data)
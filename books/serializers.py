@@ -1,24 +1,200 @@
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.utils import html
+
+from .isbn import normalize_isbn
 from .models import Author, Book
 
 
-class AuthorSerializer(serializers.ModelSerializer):
+def parse_fieldset(value):
+    """
+    Parse a ``fields``/``exclude`` query value such as ``id,title,authors.name``
+    into a nested dict: ``{'id': {}, 'title': {}, 'authors': {'name': {}}}``.
+    """
+    tree = {}
+    for path in value.split(','):
+        path = path.strip()
+        if not path:
+            continue
+        node = tree
+        for part in path.split('.'):
+            node = node.setdefault(part, {})
+    return tree
+
+
+def requested_fieldsets(request):
+    """Return the ``(fields, exclude)`` trees requested by a safe API request."""
+    if request is None or request.method not in SAFE_METHODS:
+        return None, None
+    params = getattr(request, 'query_params', request.GET)
+    fields = parse_fieldset(params['fields']) if params.get('fields') else None
+    exclude = parse_fieldset(params['exclude']) if params.get('exclude') else None
+    return fields, exclude
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients restrict the serialized fields with ``?fields=`` and
+    ``?exclude=``, including nested serializers via dotted names.
+
+    The same fieldset can be pushed down to the database with
+    ``prune_queryset()`` so unused columns and relations are never loaded.
+    """
+
+    def __init__(self, *args, fields=None, exclude=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is None and exclude is None:
+            fields, exclude = requested_fieldsets(self.context.get('request'))
+        self.apply_fieldsets(fields, exclude)
+
+    def apply_fieldsets(self, fields=None, exclude=None):
+        if fields:
+            for name in list(self.fields):
+                if name not in fields:
+                    self.fields.pop(name)
+        if exclude:
+            for name, nested in exclude.items():
+                if not nested:
+                    self.fields.pop(name, None)
+        for name, field in self.fields.items():
+            child = getattr(field, 'child', field)
+            if child is not self and isinstance(child, SparseFieldsetMixin):
+                child.apply_fieldsets(
+                    (fields or {}).get(name) or None,
+                    (exclude or {}).get(name) or None,
+                )
+
+    def prune_queryset(self, queryset):
+        """
+        Restrict ``queryset`` to the columns backing the current fields and
+        prefetch only the to-many relations that are still serialized.
+        """
+        opts = queryset.model._meta
+        columns = {opts.pk.name}
+        prefetches = []
+        for field in self.fields.values():
+            try:
+                model_field = opts.get_field(field.source)
+            except FieldDoesNotExist:
+                # Computed or dotted sources: we can't tell which columns they need.
+                return queryset
+            if model_field.many_to_many or model_field.one_to_many:
+                related = model_field.related_model._default_manager.all()
+                child = getattr(field, 'child', None)
+                if isinstance(child, SparseFieldsetMixin):
+                    related = child.prune_queryset(related)
+                prefetches.append(Prefetch(field.source, queryset=related))
+            elif model_field.concrete:
+                columns.add(model_field.name)
+        return queryset.only(*columns).prefetch_related(*prefetches)
+
+
+class AuthorSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Author
         fields = ['id', 'name', 'email', 'bio', 'birth_date']
 
 
-class BookSerializer(serializers.ModelSerializer):
-    authors = AuthorSerializer(many=True, read_only=True)
-    
+# Largest value a BigAutoField primary key can hold.
+MAX_ID = 2 ** 63 - 1
+
+
+class AuthorIdListSerializer(serializers.ListSerializer):
+    """
+    Renders authors with the child serializer but accepts a list of author
+    ids (or author objects with an ``id``), all checked in one query.
+    """
+    default_error_messages = {
+        'not_a_list': 'Expected a list of author ids but got type "{input_type}".',
+        'incorrect_type': serializers.PrimaryKeyRelatedField.default_error_messages['incorrect_type'],
+        'does_not_exist': serializers.PrimaryKeyRelatedField.default_error_messages['does_not_exist'],
+    }
+
+    def get_value(self, dictionary):
+        # Form data sends one ``authors`` value per id.
+        if html.is_html_input(dictionary) and self.field_name in dictionary:
+            return dictionary.getlist(self.field_name)
+        return super().get_value(dictionary)
+
+    def to_internal_value(self, data):
+        if isinstance(data, (str, dict)) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        ids = []
+        for item in data:
+            pk = item.get('id') if isinstance(item, dict) else item
+            if isinstance(pk, bool) or not isinstance(pk, (int, str)):
+                self.fail('incorrect_type', data_type=type(pk).__name__)
+            if isinstance(pk, str):
+                digits = pk.removeprefix('-')
+                if not (digits.isdigit() and digits.isascii()):
+                    self.fail('incorrect_type', data_type='str')
+                if len(digits.lstrip('0')) > len(str(MAX_ID)):
+                    # Out of range, and possibly too long for int().
+                    self.fail('does_not_exist', pk_value=pk)
+                pk = int(pk)
+            if not 0 < pk <= MAX_ID:
+                self.fail('does_not_exist', pk_value=pk)
+            if pk not in ids:
+                ids.append(pk)
+        authors = Author.objects.in_bulk(ids)
+        for pk in ids:
+            if pk not in authors:
+                self.fail('does_not_exist', pk_value=pk)
+        return [authors[pk] for pk in ids]
+
+
+class BookSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
+    authors = AuthorIdListSerializer(child=AuthorSerializer(), required=False)
+
     class Meta:
         model = Book
         fields = ['id', 'title', 'authors', 'isbn', 'publication_date', 'price', 'genre']
+        # Room for a hyphenated ISBN-13; it's normalized before saving.
+        extra_kwargs = {'isbn': {'max_length': 17}}
+
+    def validate_isbn(self, value):
+        isbn = normalize_isbn(value)
+        if isbn and len(isbn) > 13:
+            raise serializers.ValidationError('Enter a valid ISBN.')
+        return isbn or None
+
+    def create(self, validated_data):
+        authors = validated_data.pop('authors', None)
+        book = super().create(validated_data)
+        if authors:
+            book.set_authors(authors)
+        return book
+
+    def update(self, instance, validated_data):
+        authors = validated_data.pop('authors', None)
+        book = super().update(instance, validated_data)
+        if authors is not None:
+            book.set_authors(authors)
+        return book
 
 
-class BookListSerializer(serializers.ModelSerializer):
+class BookListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     authors = serializers.StringRelatedField(many=True)
-    
+
     class Meta:
         model = Book
-        fields = ['id', 'title', 'authors', 'isbn', 'publication_date', 'price', 'genre'] 
\ No newline at end of file
+        fields = ['id', 'title', 'authors', 'isbn', 'publication_date', 'price', 'genre']
+
+
+class ISBNResolveSerializer(serializers.Serializer):
+    isbns = serializers.ListField(
+        child=serializers.CharField(max_length=32),
+        allow_empty=False,
+        max_length=1000,
+    )
+
+
+class ChangesQuerySerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, required=False)
+
+    def validate_limit(self, value):
+        return min(value, getattr(settings, 'BOOKS_CHANGES_MAX_LIMIT', 1000))
@@ -0,0 +1,80 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .isbn import isbn_cache
+from .models import Author, Book, ChangeLogEntry
+
+
+def refresh_books(book_ids):
+    # books.materialized imports DRF; importing it here keeps DRF out of django.setup().
+    from .materialized import refresh_books
+    refresh_books(book_ids)
+
+
+def log_changes(model, object_ids, action):
+    ChangeLogEntry.objects.bulk_create(
+        ChangeLogEntry(model=model, object_id=pk, action=action) for pk in object_ids
+    )
+
+
+def books_relinked(book_ids):
+    """Record that the authors of ``book_ids`` changed."""
+    book_ids = list(book_ids)
+    if book_ids:
+        Book.objects.filter(pk__in=book_ids).update(updated_at=timezone.now())
+        log_changes('book', book_ids, ChangeLogEntry.UPDATED)
+
+
+@receiver(post_save, sender=Book)
+def book_saved(sender, instance, created, raw=False, **kwargs):
+    isbn_cache.clear()
+    log_changes('book', [instance.pk], ChangeLogEntry.CREATED if created else ChangeLogEntry.UPDATED)
+    if not raw:
+        refresh_books([instance.pk])
+
+
+@receiver(post_delete, sender=Book)
+def book_deleted(sender, instance, **kwargs):
+    isbn_cache.clear()
+    log_changes('book', [instance.pk], ChangeLogEntry.DELETED)
+
+
+@receiver(m2m_changed, sender=Book.authors.through)
+def book_authors_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # author.books.clear() doesn't say which books it touched.
+        instance._cleared_book_ids = list(instance.books.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear', 'post_set'):
+        return
+    isbn_cache.clear()
+    if not reverse:
+        book_ids = [instance.pk]
+    elif action == 'post_clear':
+        book_ids = getattr(instance, '_cleared_book_ids', [])
+    else:
+        book_ids = pk_set
+    books_relinked(book_ids)
+    refresh_books(book_ids)
+
+
+@receiver(post_save, sender=Author)
+def author_saved(sender, instance, created, raw=False, **kwargs):
+    isbn_cache.clear()
+    log_changes('author', [instance.pk], ChangeLogEntry.CREATED if created else ChangeLogEntry.UPDATED)
+    if not created and not raw:
+        refresh_books(instance.books.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Author)
+def author_deleting(sender, instance, **kwargs):
+    instance._deleted_book_ids = list(instance.books.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Author)
+def author_deleted(sender, instance, **kwargs):
+    isbn_cache.clear()
+    book_ids = getattr(instance, '_deleted_book_ids', [])
+    log_changes('author', [instance.pk], ChangeLogEntry.DELETED)
+    books_relinked(book_ids)
+    refresh_books(book_ids)
@@ -0,0 +1,133 @@
+"""
+Opt-in slow query log.
+
+When ``BOOKS_SLOW_QUERY_LOG`` names a file, ``SlowQueryLogMiddleware`` wraps
+database execution for a sample of requests and appends one JSON line per
+query slower than ``BOOKS_SLOW_QUERY_THRESHOLD_MS``, with its query plan, the
+view that issued it and the normalized request parameters. Summarize the log
+with ``manage.py slow_queries``.
+"""
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, connection
+from django.utils import timezone
+
+from .utils import normalized_params, view_label
+
+logger = logging.getLogger('books.slow_queries')
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """Replace literals and placeholders with ``?`` and collapse ``IN`` lists."""
+    sql = _STRING.sub('?', sql)
+    sql = _NUMBER.sub('?', sql.replace('%s', '?'))
+    sql = _PLACEHOLDER_LIST.sub('(...)', sql)
+    return _WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize_sql(sql).encode()).hexdigest()[:16]
+
+
+class SlowQueryRecorder:
+    """
+    Execute wrapper that collects queries slower than ``threshold`` seconds.
+    ``flush()`` explains and logs them.
+    """
+
+    def __init__(self, request, threshold):
+        self.request = request
+        self.threshold = threshold
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        result = execute(sql, params, many, context)
+        duration = time.perf_counter() - start
+        if duration >= self.threshold:
+            self.slow.append((timezone.now(), sql, params, many, duration, context['connection']))
+        return result
+
+    def explain(self, sql, params, many, db):
+        if many or sql.lstrip()[:6].upper() != 'SELECT':
+            return None
+        try:
+            with db.cursor() as cursor:
+                cursor.execute(f'{db.ops.explain_query_prefix()} {sql}', params)
+                return [[str(column) for column in row] for row in cursor.fetchall()]
+        except DatabaseError:
+            return None
+
+    def flush(self):
+        for entry in self.slow:
+            self.log(*entry)
+        self.slow = []
+
+    def log(self, logged_at, sql, params, many, duration, db):
+        request = self.request
+        match = request.resolver_match
+        entry = {
+            'time': logged_at.isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'fingerprint': fingerprint(sql),
+            'sql': sql,
+            'plan': self.explain(sql, params, many, db),
+            'view': match.view_name if match else None,
+            'action': view_label(match, request.method),
+            'method': request.method,
+            'path': request.path,
+            'params': normalized_params(request.GET),
+        }
+        logger.info(json.dumps(entry, default=str))
+
+
+def configure_logger(path):
+    """Attach a rotating JSONL handler for ``path`` to the slow query logger once."""
+    for handler in logger.handlers:
+        if getattr(handler, 'baseFilename', None) == str(path):
+            return
+    handler = RotatingFileHandler(
+        path,
+        maxBytes=getattr(settings, 'BOOKS_SLOW_QUERY_LOG_MAX_BYTES', 10 * 1024 * 1024),
+        backupCount=getattr(settings, 'BOOKS_SLOW_QUERY_LOG_BACKUP_COUNT', 5),
+        encoding='utf-8',
+    )
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+class SlowQueryLogMiddleware:
+    def __init__(self, get_response):
+        path = getattr(settings, 'BOOKS_SLOW_QUERY_LOG', None)
+        if not path:
+            raise MiddlewareNotUsed
+        configure_logger(path)
+        self.get_response = get_response
+        self.threshold = getattr(settings, 'BOOKS_SLOW_QUERY_THRESHOLD_MS', 100) / 1000
+        self.sample_rate = getattr(settings, 'BOOKS_SLOW_QUERY_SAMPLE_RATE', 1.0)
+
+    def __call__(self, request):
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+        recorder = SlowQueryRecorder(request, self.threshold)
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        # The server closes the response once the client has it, after
+        # MetricsMiddleware has timed the request; the EXPLAINs run then.
+        response._resource_closers.append(recorder.flush)
+        return response
@@ -0,0 +1,134 @@
+"""
+Cold-start profiling for ``manage.py profile_startup``.
+
+``run_phases()`` runs in a fresh interpreter, usually under
+``python -X importtime``. It boots the project the way a worker does:
+``django.setup()``, then the WSGI or ASGI handler with its middleware, then
+the first requests, which load the URLconf and views. After each phase it
+writes a marker line to stderr. ``parse_importtime()`` splits the import
+timings between those markers, so each phase can be broken down by module.
+Python only times ``import`` statements: modules loaded with
+``importlib.import_module()`` (models, admin modules, URLconfs) are missing
+from the breakdown, but what they import is listed.
+
+This module must stay importable without Django, so that it doesn't skew the
+timings it takes.
+"""
+import functools
+import json
+import re
+import sys
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+MARKER = 'books.startup:'
+IMPORT_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)')
+# Packages that are broken down one level further in the report.
+SPLIT_PACKAGES = ('django', 'rest_framework', 'books')
+
+
+def run_phases(app, paths):
+    """Boot the project and request ``paths``; print each phase's duration to stderr."""
+    phases = []
+
+    def phase(name, func):
+        start = time.perf_counter()
+        result = func()
+        phases.append((name, time.perf_counter() - start))
+        print(f'{MARKER} {json.dumps([name, phases[-1][1]])}', file=sys.stderr, flush=True)
+        return result
+
+    def setup():
+        import django
+        django.setup(set_prefix=False)
+
+    def application():
+        if app == 'asgi':
+            from django.core.handlers.asgi import ASGIHandler
+            return ASGIHandler()
+        from django.core.handlers.wsgi import WSGIHandler
+        return WSGIHandler()
+
+    def harness():
+        # The request helpers aren't part of a worker's boot; their phase is left out of reports.
+        import asyncio
+
+        from books import loadtest
+        from books.utils import default_host
+        return asyncio, loadtest, {'Host': default_host(), 'Accept': 'application/json'}
+
+    def send(request):
+        if app == 'asgi':
+            return asyncio.run(loadtest.call_asgi(handler, request, headers))
+        return loadtest.call_wsgi(handler, request, headers)
+
+    # Everything imported so far belongs to the interpreter and this module.
+    phase('_interpreter', lambda: None)
+    phase('setup', setup)
+    handler = phase('application', application)
+    asyncio, loadtest, headers = phase('_harness', harness)
+    for path in paths:
+        url = urlsplit(path)
+        request = loadtest.Request(f'GET {path}', 'GET', url.path, parse_qsl(url.query))
+        status, _ = phase(request.operation, functools.partial(send, request))
+        if status >= 400:
+            print(f'{MARKER} {json.dumps(["_error", f"{request.operation} returned {status}"])}', file=sys.stderr, flush=True)
+    return phases
+
+
+def module_group(name):
+    parts = name.split('.')
+    if parts[0] in SPLIT_PACKAGES and len(parts) > 1:
+        return '.'.join(parts[:2])
+    return parts[0]
+
+
+def parse_importtime(lines):
+    """
+    Split ``-X importtime`` output at the phase markers. Returns a list of
+    ``{'phase', 'seconds', 'imports'}`` dicts, where ``imports`` maps each
+    imported module to ``(self_us, cumulative_us, depth)``, and a list of
+    requests that failed.
+    """
+    phases = []
+    imports = {}
+    errors = []
+    for line in lines:
+        if line.startswith(MARKER):
+            name, value = json.loads(line[len(MARKER):])
+            if name == '_error':
+                errors.append(value)
+                continue
+            phases.append({'phase': name, 'seconds': value, 'imports': imports})
+            imports = {}
+            continue
+        match = IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports[module] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return phases, errors
+
+
+def summarize_imports(imports, top):
+    """Import time of one phase, by package (self time) and by direct import (cumulative)."""
+    groups = {}
+    for module, (self_us, _, _) in imports.items():
+        group = module_group(module)
+        groups[group] = groups.get(group, 0) + self_us
+    direct = [(module, cumulative) for module, (_, cumulative, depth) in imports.items() if depth == 0]
+    return {
+        'import_ms': round(sum(self_us for self_us, _, _ in imports.values()) / 1000, 2),
+        'modules': len(imports),
+        'packages': [
+            {'package': group, 'ms': round(us / 1000, 2)}
+            for group, us in sorted(groups.items(), key=lambda item: item[1], reverse=True)[:top]
+        ],
+        'imported_by_phase': [
+            {'module': module, 'ms': round(us / 1000, 2)}
+            for module, us in sorted(direct, key=lambda item: item[1], reverse=True)[:top]
+        ],
+    }
+
+
+if __name__ == '__main__':
+    run_phases(sys.argv[1], sys.argv[2:])
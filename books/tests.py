@@ -1,15 +1,47 @@
-from django.test import TestCase, Client
+from django.core.management import CommandError, call_command
+from django.http import HttpResponse, QueryDict
+from django.test import AsyncClient, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
 from django.urls import reverse
+from django.db.models.signals import m2m_changed
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
 from django.contrib.auth.models import User
+from django.utils import timezone
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
 from decimal import Decimal
-from datetime import date
+from datetime import date, timedelta
+import fcntl
 import json
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+from urllib.parse import urlencode
 
-from .models import Author, Book
+
+from . import loadtest, materialized, metrics, slowlog, startup, traffic
+from .models import Author, Book, ChangeLogEntry, MaterializedResult
 from .serializers import AuthorSerializer, BookSerializer, BookListSerializer
+from .views import BookViewSet
+from .memory_index import Generation, book_index
+from .coalesce import FileLease, SharedResponse, SingleFlight, coalesce_key
 from .filters import BookFilter
+from .isbn import isbn_cache, normalize_isbn
+from .renderers import ColumnarJSONRenderer, ColumnarQuery
+
+
+def response_json(response):
+    """Decode a response that may be streamed, as materialized actions are."""
+    if response.streaming:
+        return json.loads(b''.join(response.streaming_content))
+    return json.loads(response.content)
 
 
 class AuthorModelTest(TestCase):
@@ -398,23 +430,26 @@ class BookAPITest(APITestCase):
         url = reverse('books:book-by-genre')
         response = self.client.get(url, {'genre': 'Fantasy'})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        data = response_json(response)
+        self.assertEqual(len(data), 2)
 
     def test_expensive_books_action(self):
         Book.objects.create(title="Expensive Book", price=Decimal("75.00"))
         url = reverse('books:book-expensive-books')
         response = self.client.get(url, {'min_price': 50})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], 'Expensive Book')
+        data = response_json(response)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['title'], 'Expensive Book')
 
     def test_expensive_books_default_min_price(self):
         Book.objects.create(title="Expensive Book", price=Decimal("75.00"))
         url = reverse('books:book-expensive-books')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
-        self.assertEqual(response.data[0]['title'], 'Expensive Book')
+        data = response_json(response)
+        self.assertEqual(len(data), 1)
+        self.assertEqual(data[0]['title'], 'Expensive Book')
 
 
 class APIIntegrationTest(APITestCase):
@@ -478,3 +513,1215 @@ class APIIntegrationTest(APITestCase):
         # Verify book has multiple authors
         book_detail = self.client.get(reverse('books:book-detail', args=[book.id]))
         self.assertEqual(len(book_detail.data['authors']), 2)
+
+
+class SparseFieldsetAPITest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author1 = Author.objects.create(name="J.K. Rowling", email="jk@example.com")
+        self.author2 = Author.objects.create(name="George R.R. Martin")
+        for i in range(3):
+            book = Book.objects.create(
+                title=f"Book {i}",
+                isbn=f"978000000000{i}",
+                price=Decimal("10.00") + i,
+                genre="Fantasy"
+            )
+            book.authors.add(self.author1, self.author2)
+        self.book = book
+
+    def test_fields_restricts_list_output(self):
+        response = self.client.get(reverse('books:book-list'), {'fields': 'id,title'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(set(response.data['results'][0].keys()), {'id', 'title'})
+
+    def test_exclude_removes_fields(self):
+        response = self.client.get(reverse('books:book-list'), {'exclude': 'isbn,authors'})
+        self.assertEqual(
+            set(response.data['results'][0].keys()),
+            {'id', 'title', 'publication_date', 'price', 'genre'}
+        )
+
+    def test_nested_author_fields_on_detail(self):
+        url = reverse('books:book-detail', args=[self.book.id])
+        response = self.client.get(url, {'fields': 'title,authors.name'})
+        self.assertEqual(set(response.data.keys()), {'title', 'authors'})
+        self.assertEqual(response.data['authors'], [{'name': 'George R.R. Martin'}, {'name': 'J.K. Rowling'}])
+
+    def test_nested_exclude_on_detail(self):
+        url = reverse('books:book-detail', args=[self.book.id])
+        response = self.client.get(url, {'exclude': 'authors.bio,authors.email'})
+        self.assertEqual(set(response.data['authors'][0].keys()), {'id', 'name', 'birth_date'})
+
+    def test_author_fields(self):
+        response = self.client.get(reverse('books:author-list'), {'fields': 'name'})
+        self.assertEqual(response.data['results'][0], {'name': 'George R.R. Martin'})
+
+    def test_author_prefetch_skipped_when_not_requested(self):
+        # count + page query only, no per-book or prefetch author queries
+        with self.assertNumQueries(2):
+            self.client.get(reverse('books:book-list'), {'fields': 'id,title'})
+
+    def test_authors_prefetched_when_requested(self):
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('books:book-list'), {'fields': 'id,authors'})
+        self.assertEqual(len(response.data['results'][0]['authors']), 2)
+
+    def test_columns_deferred(self):
+        queryset = BookSerializer(fields={'title': {}}).prune_queryset(Book.objects.all())
+        self.assertEqual(queryset.query.deferred_loading, ({'id', 'title'}, False))
+
+
+class ColumnarRendererTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author1 = Author.objects.create(name="J.K. Rowling")
+        self.author2 = Author.objects.create(name="George R.R. Martin")
+        for i in range(4):
+            book = Book.objects.create(
+                title=f"Book {i}",
+                isbn=f"978000000000{i}",
+                publication_date=date(2000 + i, 1, 1),
+                price=Decimal("10.50") + i,
+                genre="Fantasy"
+            )
+            book.authors.add(self.author1, self.author2)
+
+    def rows_from_columns(self, payload):
+        columns, tables = payload['columns'], payload['tables']
+        rows = []
+        for i in range(len(columns['id'])):
+            row = {}
+            for name, values in columns.items():
+                if name in tables:
+                    table = tables[name]
+                    if isinstance(table, dict):
+                        table = [dict(zip(table, values)) for values in zip(*table.values())]
+                    row[name] = [table[index] for index in values[i]]
+                else:
+                    row[name] = values[i]
+            rows.append(row)
+        return rows
+
+    def test_format_query_param_selects_columnar(self):
+        response = self.client.get(reverse('books:book-list'), {'format': 'columnar'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/vnd.books.columnar+json')
+        payload = json.loads(response.content)
+        self.assertEqual(payload['count'], 4)
+        self.assertEqual(payload['results']['columns']['title'], ['Book 0', 'Book 1', 'Book 2', 'Book 3'])
+        self.assertEqual(payload['results']['tables']['authors'], ['George R.R. Martin', 'J.K. Rowling'])
+
+    def test_accept_header_selects_columnar(self):
+        response = self.client.get(reverse('books:book-list'), HTTP_ACCEPT='application/vnd.books.columnar+json')
+        self.assertIn('columns', json.loads(response.content)['results'])
+
+    def test_columnar_matches_default_rows(self):
+        default = json.loads(self.client.get(reverse('books:book-list'), {'format': 'json'}).content)
+        columnar = json.loads(self.client.get(reverse('books:book-list'), {'format': 'columnar'}).content)
+        self.assertEqual(self.rows_from_columns(columnar['results']), default['results'])
+
+    def test_nested_authors_deduplicated(self):
+        data = BookSerializer(Book.objects.prefetch_related('authors'), many=True).data
+        payload = json.loads(ColumnarJSONRenderer().render(data))
+        self.assertEqual(len(payload['tables']['authors']['id']), 2)
+        self.assertEqual(json.loads(json.dumps(self.rows_from_columns(payload))), json.loads(json.dumps(data)))
+
+    def test_columnar_is_smaller_than_json(self):
+        query = ColumnarQuery(BookSerializer(), Book.objects.all())
+        columnar = ColumnarJSONRenderer().render(query.columns(query.values()))
+        default = JSONRenderer().render(BookSerializer(Book.objects.all(), many=True).data)
+        self.assertLess(len(columnar), len(default))
+
+    def test_columnar_respects_sparse_fieldsets(self):
+        response = self.client.get(reverse('books:book-list'), {'format': 'columnar', 'fields': 'id,title'})
+        payload = json.loads(response.content)
+        self.assertEqual(list(payload['results']['columns']), ['id', 'title'])
+        self.assertEqual(payload['results']['tables'], {})
+
+    def test_detail_renders_plain_json(self):
+        book = Book.objects.first()
+        response = self.client.get(reverse('books:book-detail', args=[book.id]), {'format': 'columnar'})
+        self.assertEqual(json.loads(response.content)['title'], book.title)
+
+
+class MetricsTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = Author.objects.create(name="J.K. Rowling")
+        self.book = Book.objects.create(title="Harry Potter", genre="Fantasy")
+        self.book.authors.add(self.author)
+        metrics.registry._reset()
+
+    def series(self, metric, **labels):
+        for name, series_labels, values in metrics.registry.snapshot():
+            if name == metric and all(item in series_labels for item in labels.items()):
+                yield dict(series_labels), values
+
+    def test_list_request_records_phases(self):
+        self.client.get(reverse('books:book-list'), {'genre': 'Fantasy'})
+        phases = {labels['phase'] for labels, _ in self.series('books_request_phase_seconds', view='books:book-list')}
+        self.assertEqual(phases, {'filter', 'count', 'query', 'serialize', 'render'})
+
+    def test_query_count_and_bytes_recorded(self):
+        response = self.client.get(reverse('books:book-list'))
+        [(_, queries)] = self.series('books_request_queries', view='books:book-list')
+        [(_, size)] = self.series('books_response_bytes', view='books:book-list')
+        self.assertEqual(queries[-1], 1)
+        self.assertGreater(queries[-2], 0)
+        self.assertEqual(size[-2], len(response.content))
+
+    def test_metrics_endpoint_prometheus_format(self):
+        self.client.get(reverse('books:book-list'))
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE books_request_duration_seconds histogram', text)
+        self.assertIn('books_request_duration_seconds_count{method="GET",view="books:book-list"} 1', text)
+        self.assertIn('books_request_phase_seconds_bucket{method="GET",view="books:book-list",phase="filter",le="+Inf"} 1', text)
+
+    def test_histogram_buckets_are_cumulative(self):
+        labels = (('method', 'GET'), ('view', 'v'))
+        for value in (0, 1, 4, 200):
+            metrics.registry.observe('books_request_queries', labels, value)
+        text = metrics.render_prometheus(metrics.registry.snapshot())
+        self.assertIn('books_request_queries_bucket{method="GET",view="v",le="0"} 1', text)
+        self.assertIn('books_request_queries_bucket{method="GET",view="v",le="5"} 3', text)
+        self.assertIn('books_request_queries_bucket{method="GET",view="v",le="+Inf"} 4', text)
+        self.assertIn('books_request_queries_sum{method="GET",view="v"} 205', text)
+
+    def test_shared_directory_merges_workers(self):
+        labels = (('method', 'GET'), ('view', 'v'))
+        with tempfile.TemporaryDirectory() as directory, self.settings(BOOKS_METRICS_DIR=directory):
+            other = metrics.Registry()
+            other.observe('books_request_queries', labels, 2)
+            other.flush(force=True)
+            metrics.registry.observe('books_request_queries', labels, 3)
+            collected = metrics.registry.collect()
+        [values] = [values for metric, _, values in collected if metric == 'books_request_queries']
+        self.assertEqual(values[-1], 2)
+        self.assertEqual(values[-2], 5)
+
+    def age(self, path, seconds):
+        os.utime(path, (time.time() - seconds, time.time() - seconds))
+
+    def totals(self, collected):
+        [values] = [values for metric, _, values in collected if metric == 'books_request_queries']
+        return values
+
+    def test_folding_exited_workers_keeps_totals(self):
+        labels = (('method', 'GET'), ('view', 'v'))
+        with tempfile.TemporaryDirectory() as directory, self.settings(BOOKS_METRICS_DIR=directory, BOOKS_METRICS_RETENTION=60):
+            exited = metrics.Registry()
+            exited.observe('books_request_queries', labels, 2)
+            exited.flush(force=True)
+            metrics.registry.observe('books_request_queries', labels, 3)
+            before = self.totals(metrics.registry.collect())
+            [path] = [path for path in Path(directory).glob('metrics-*.json') if exited._token in path.name]
+            self.age(path, 120)
+            after = self.totals(metrics.registry.collect())
+            self.assertFalse(path.exists())
+            self.assertTrue((Path(directory) / metrics.DEAD_WORKERS).exists())
+        self.assertEqual(before[-2:], [5, 2])
+        self.assertEqual(after, before)
+
+    def test_idle_worker_is_not_counted_twice(self):
+        labels = (('method', 'GET'), ('view', 'v'))
+        with tempfile.TemporaryDirectory() as directory, self.settings(BOOKS_METRICS_DIR=directory, BOOKS_METRICS_RETENTION=60):
+            idle = metrics.Registry()
+            idle.observe('books_request_queries', labels, 2)
+            idle.flush(force=True)
+            self.age(Path(directory) / f'metrics-{idle._token}.json', 120)
+            self.assertEqual(self.totals(metrics.registry.collect())[-2:], [2, 1])
+            idle.observe('books_request_queries', labels, 4)
+            idle.flush(force=True)
+            self.assertEqual(self.totals(metrics.registry.collect())[-2:], [6, 2])
+
+
+class SlowQueryLogTest(APITestCase):
+    def setUp(self):
+        self.author = Author.objects.create(name="J.K. Rowling")
+        Book.objects.create(title="Harry Potter", genre="Fantasy").authors.add(self.author)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.log_path = Path(self.directory.name) / 'slow.jsonl'
+        self.addCleanup(self.remove_handlers)
+
+    def remove_handlers(self):
+        for handler in list(slowlog.logger.handlers):
+            slowlog.logger.removeHandler(handler)
+            handler.close()
+
+    def request_with_log(self, **overrides):
+        options = {'BOOKS_SLOW_QUERY_LOG': str(self.log_path), 'BOOKS_SLOW_QUERY_THRESHOLD_MS': 0, **overrides}
+        with self.settings(**options):
+            return APIClient().get(reverse('books:book-list'), {'genre': 'Fantasy', 'ordering': '-price'})
+
+    def entries(self):
+        if not self.log_path.exists():
+            return []
+        return [json.loads(line) for line in self.log_path.read_text().splitlines()]
+
+    def test_slow_queries_logged_with_plan_and_origin(self):
+        self.request_with_log()
+        entries = self.entries()
+        self.assertTrue(entries)
+        entry = entries[-1]
+        self.assertEqual(entry['action'], 'BookViewSet.list')
+        self.assertEqual(entry['view'], 'books:book-list')
+        self.assertEqual(entry['params'], {'genre': ['Fantasy'], 'ordering': ['-price']})
+        self.assertTrue(entry['plan'])
+        self.assertEqual(entry['fingerprint'], slowlog.fingerprint(entry['sql']))
+
+    def test_explain_not_counted_in_request_metrics(self):
+        metrics.registry._reset()
+        self.request_with_log()
+        self.assertTrue(all(entry['plan'] for entry in self.entries()))
+        [queries] = [
+            values for metric, labels, values in metrics.registry.snapshot()
+            if metric == 'books_request_queries' and ('view', 'books:book-list') in labels
+        ]
+        self.assertEqual(queries[-2], len(self.entries()))
+
+    def test_explained_after_response_closed(self):
+        def view(request):
+            list(Book.objects.all())
+            return HttpResponse('ok')
+
+        with self.settings(BOOKS_SLOW_QUERY_LOG=str(self.log_path), BOOKS_SLOW_QUERY_THRESHOLD_MS=0):
+            response = slowlog.SlowQueryLogMiddleware(view)(RequestFactory().get('/api/books/'))
+            self.assertEqual(self.entries(), [])
+            response.close()
+        [entry] = self.entries()
+        self.assertTrue(entry['plan'])
+
+    def test_sample_rate_zero_logs_nothing(self):
+        self.request_with_log(BOOKS_SLOW_QUERY_SAMPLE_RATE=0)
+        self.assertEqual(self.entries(), [])
+
+    def test_threshold_filters_fast_queries(self):
+        self.request_with_log(BOOKS_SLOW_QUERY_THRESHOLD_MS=60_000)
+        self.assertEqual(self.entries(), [])
+
+    def test_fingerprint_ignores_literals_and_in_lists(self):
+        self.assertEqual(
+            slowlog.fingerprint('SELECT * FROM t WHERE id IN (%s, %s) LIMIT 10'),
+            slowlog.fingerprint('SELECT *  FROM t WHERE id IN (%s) LIMIT 20'),
+        )
+        self.assertNotEqual(slowlog.fingerprint('SELECT a FROM t'), slowlog.fingerprint('SELECT b FROM t'))
+
+    def test_report_groups_by_fingerprint(self):
+        self.request_with_log()
+        self.request_with_log()
+        out = StringIO()
+        call_command('slow_queries', path=str(self.log_path), json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        self.assertEqual(len(report), len({entry['fingerprint'] for entry in self.entries()}))
+        self.assertEqual(sum(group['count'] for group in report), len(self.entries()))
+        self.assertIn('BookViewSet.list', report[0]['views'])
+
+
+@override_settings(BOOKS_MATERIALIZED_MIN_HITS=1)
+class MaterializedResultTest(APITestCase):
+    def setUp(self):
+        materialized.hit_counter.clear()
+        self.addCleanup(materialized.hit_counter.clear)
+        self.client = APIClient()
+        self.author = Author.objects.create(name="J.K. Rowling")
+        self.book1 = Book.objects.create(title="Harry Potter", genre="Fantasy", price=Decimal("19.99"))
+        self.book1.authors.add(self.author)
+        self.book2 = Book.objects.create(title="Game of Thrones", genre="Epic Fantasy", price=Decimal("75.00"))
+        self.book3 = Book.objects.create(title="Dune", genre="Science Fiction", price=Decimal("55.00"))
+
+    def by_genre(self, genre, **params):
+        response = self.client.get(reverse('books:book-by-genre'), {'genre': genre, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        if response.streaming:
+            return json.loads(b''.join(response.streaming_content))
+        return response.data
+
+    def expensive(self, min_price=None):
+        params = {} if min_price is None else {'min_price': min_price}
+        response = self.client.get(reverse('books:book-expensive-books'), params)
+        return json.loads(b''.join(response.streaming_content))
+
+    def test_matches_live_serialization(self):
+        data = self.by_genre('fantasy')
+        live = BookSerializer(Book.objects.filter(genre__icontains='fantasy'), many=True).data
+        self.assertEqual(data, json.loads(json.dumps(live)))
+        self.assertEqual(MaterializedResult.objects.get().param, 'fantasy')
+
+    def test_second_request_reads_materialized_rows(self):
+        self.by_genre('Fantasy')
+        with self.assertNumQueries(2):
+            self.assertEqual([book['title'] for book in self.by_genre('FANTASY')], ['Game of Thrones', 'Harry Potter'])
+
+    def test_genre_change_updates_result(self):
+        self.by_genre('fantasy')
+        self.book3.genre = 'Dark Fantasy'
+        self.book3.save()
+        self.book1.genre = 'Wizardry'
+        self.book1.save()
+        self.assertEqual([book['title'] for book in self.by_genre('fantasy')], ['Dune', 'Game of Thrones'])
+
+    def test_price_change_updates_result(self):
+        self.assertEqual([book['title'] for book in self.expensive()], ['Dune', 'Game of Thrones'])
+        self.book1.price = Decimal("50.00")
+        self.book1.save()
+        self.book3.price = Decimal("5.00")
+        self.book3.save()
+        self.assertEqual([book['title'] for book in self.expensive('50')], ['Game of Thrones', 'Harry Potter'])
+        self.assertEqual(MaterializedResult.objects.count(), 1)
+
+    def test_author_changes_update_payloads(self):
+        self.by_genre('fantasy')
+        other = Author.objects.create(name="George R.R. Martin")
+        self.book2.authors.add(other)
+        self.author.name = "Joanne Rowling"
+        self.author.save()
+        data = {book['title']: book for book in self.by_genre('fantasy')}
+        self.assertEqual([a['name'] for a in data['Game of Thrones']['authors']], ['George R.R. Martin'])
+        self.assertEqual([a['name'] for a in data['Harry Potter']['authors']], ['Joanne Rowling'])
+        self.author.delete()
+        data = {book['title']: book for book in self.by_genre('fantasy')}
+        self.assertEqual(data['Harry Potter']['authors'], [])
+
+    def test_deleted_book_removed(self):
+        self.by_genre('fantasy')
+        self.book2.delete()
+        self.assertEqual([book['title'] for book in self.by_genre('fantasy')], ['Harry Potter'])
+
+    def test_paginated(self):
+        data = self.by_genre('', page=1)
+        self.assertEqual(data['count'], 3)
+        self.assertEqual([book['title'] for book in data['results']], ['Dune', 'Game of Thrones', 'Harry Potter'])
+
+    def test_falls_back_when_not_materializable(self):
+        with self.settings(BOOKS_MATERIALIZED_MAX_RESULTS=0):
+            self.assertEqual(len(self.by_genre('fantasy')), 2)
+        self.assertFalse(MaterializedResult.objects.exists())
+        self.assertIsNone(materialized.get_result('expensive_books', 'NaN'))
+
+    def test_empty_genre_not_materialized(self):
+        self.assertEqual(len(self.by_genre('')), 3)
+        self.assertFalse(MaterializedResult.objects.exists())
+
+    def test_materialized_once_hot(self):
+        with self.settings(BOOKS_MATERIALIZED_MIN_HITS=3):
+            for _ in range(2):
+                self.assertEqual(len(self.by_genre('fantasy')), 2)
+                self.assertFalse(MaterializedResult.objects.exists())
+            self.by_genre('fantasy')
+        self.assertEqual(MaterializedResult.objects.get().param, 'fantasy')
+
+    def test_least_recently_used_evicted(self):
+        with self.settings(BOOKS_MATERIALIZED_MAX_RESULTS=2):
+            self.by_genre('fantasy')
+            self.by_genre('fiction')
+            MaterializedResult.objects.filter(param='fantasy').update(last_used_at=timezone.now() - timedelta(hours=1))
+            self.by_genre('epic')
+        self.assertEqual(sorted(MaterializedResult.objects.values_list('param', flat=True)), ['epic', 'fiction'])
+
+    def test_expired_and_outdated_results_evicted(self):
+        self.by_genre('fantasy')
+        self.by_genre('fiction')
+        MaterializedResult.objects.filter(param='fantasy').update(last_used_at=timezone.now() - timedelta(days=2))
+        MaterializedResult.objects.filter(param='fiction').update(version='0:old')
+        # The outdated result isn't served; its value is rebuilt instead.
+        self.assertEqual(len(self.by_genre('fiction')), 1)
+        self.assertEqual(
+            list(MaterializedResult.objects.values_list('param', 'version')),
+            [('fiction', materialized.payload_version())],
+        )
+
+
+    async def test_asgi_response_streams_asynchronously(self):
+        url = reverse('books:book-by-genre')
+        await AsyncClient().get(url, {'genre': 'fantasy'})
+        response = await AsyncClient().get(url, {'genre': 'fantasy'})
+        self.assertTrue(response.is_async)
+        content = b''.join([chunk async for chunk in response.streaming_content])
+        self.assertEqual([book['title'] for book in json.loads(content)], ['Game of Thrones', 'Harry Potter'])
+
+    def test_built_in_batches(self):
+        Book.objects.create(title="Beowulf", genre="Fantasy")
+        with mock.patch.object(materialized, 'BUILD_BATCH', 1), CaptureQueriesContext(connection) as queries:
+            self.by_genre('fantasy')
+        inserts = [query for query in queries if query['sql'].startswith('INSERT') and 'materializedresultrow' in query['sql']]
+        self.assertEqual(len(inserts), 3)
+        self.assertTrue(MaterializedResult.objects.get().complete)
+
+    def test_change_during_build_applied(self):
+        render_book = materialized.render_book
+
+        def render_and_change(book):
+            payload = render_book(book)
+            if book.pk == self.book1.pk:
+                # Saved after the build read it, before its row is inserted.
+                changed = Book.objects.get(pk=book.pk)
+                changed.genre = 'Wizardry'
+                changed.save()
+            return payload
+
+        with mock.patch.object(materialized, 'render_book', render_and_change):
+            materialized.get_result('by_genre', 'fantasy')
+        self.assertEqual([book['title'] for book in self.by_genre('fantasy')], ['Game of Thrones'])
+
+    def test_incomplete_result_not_served(self):
+        MaterializedResult.objects.create(action='by_genre', param='fantasy', version=materialized.payload_version())
+        self.assertIsNone(materialized.get_result('by_genre', 'fantasy'))
+        self.assertEqual(len(self.by_genre('fantasy')), 2)
+
+
+class ISBNMigrationTest(TransactionTestCase):
+    before = [('books', '0003_materialized_results')]
+    after = [('books', '0004_normalize_isbn')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.executor.loader.build_graph()
+        self.addCleanup(self.migrate_to_latest)
+        self.Book = self.executor.loader.project_state(self.before).apps.get_model('books', 'Book')
+
+    def migrate_to_latest(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def migrate(self):
+        self.executor.loader.build_graph()
+        self.executor.migrate(self.after)
+
+    def test_normalizes_isbns(self):
+        first = self.Book.objects.create(title="A", isbn='0-7475-3269-9')
+        second = self.Book.objects.create(title="B", isbn='978 0553 103540')
+        blank = self.Book.objects.create(title="C", isbn='')
+        self.migrate()
+        self.assertEqual(
+            dict(self.Book.objects.values_list('pk', 'isbn')),
+            {first.pk: '9780747532699', second.pk: '9780553103540', blank.pk: None},
+        )
+
+    def test_duplicates_reported(self):
+        first = self.Book.objects.create(title="A", isbn='0-7475-3269-9')
+        second = self.Book.objects.create(title="B", isbn='9780747532699')
+        with self.assertRaisesMessage(RuntimeError, f'9780747532699: books {first.pk}, {second.pk}'):
+            self.migrate()
+        self.Book.objects.filter(pk=second.pk).delete()
+
+
+class ISBNTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='testuser', password='testpass')
+        self.client.force_authenticate(user=self.user)
+        self.author = Author.objects.create(name="J.K. Rowling")
+        self.book = Book.objects.create(title="Harry Potter", isbn="0-7475-3269-9")
+        self.book.authors.add(self.author)
+        isbn_cache.clear()
+
+    def resolve(self, isbns):
+        response = self.client.post(reverse('books:book-resolve-isbns'), {'isbns': isbns}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data['results']
+
+    def test_normalize_isbn(self):
+        self.assertEqual(normalize_isbn('0-7475-3269-9'), '9780747532699')
+        self.assertEqual(normalize_isbn('080442957x'), '9780804429573')
+        self.assertEqual(normalize_isbn('978 0 7475 3269 9'), '9780747532699')
+        self.assertEqual(normalize_isbn('0747532690'), '0747532690')
+        self.assertIsNone(normalize_isbn(None))
+
+    def test_isbn_stored_normalized(self):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.isbn, '9780747532699')
+        self.assertEqual(Book.objects.create(title="No ISBN", isbn='').isbn, None)
+
+    def test_isbn_unique_across_forms(self):
+        response = self.client.post(reverse('books:book-list'), {'title': 'Copy', 'isbn': '978-0-7475-3269-9'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('isbn', response.data)
+
+    def test_api_accepts_hyphenated_isbn(self):
+        response = self.client.post(reverse('books:book-list'), {'title': 'Dune', 'isbn': '0-441-17271-7'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['isbn'], '9780441172719')
+
+    def test_exact_isbn_filter(self):
+        Book.objects.create(title="Other", isbn="9780553103540")
+        response = self.client.get(reverse('books:book-list'), {'isbn': '0747532699'})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['title'], 'Harry Potter')
+
+    def test_search_finds_isbn_in_any_form(self):
+        Book.objects.create(title="Other", isbn="9780553103540")
+        for term in ('0-7475-3269-9', '0747532699', '978-0-7475-3269-9', '0-7475', 'Harry'):
+            response = self.client.get(reverse('books:book-list'), {'search': term})
+            self.assertEqual([book['title'] for book in response.data['results']], ['Harry Potter'], term)
+
+    def test_resolve_isbns(self):
+        results = self.resolve(['0-7475-3269-9', '9780747532699', '9780000000000'])
+        self.assertEqual(results['0-7475-3269-9']['title'], 'Harry Potter')
+        self.assertEqual(results['9780747532699']['authors'][0]['name'], 'J.K. Rowling')
+        self.assertIsNone(results['9780000000000'])
+
+    def test_resolve_isbns_cached(self):
+        self.resolve(['9780747532699', '9780000000000'])
+        with self.assertNumQueries(0):
+            results = self.resolve(['9780747532699', '9780000000000'])
+        self.assertEqual(results['9780747532699']['title'], 'Harry Potter')
+
+    def test_cache_invalidated_on_write(self):
+        self.assertIsNone(self.resolve(['9780553103540'])['9780553103540'])
+        Book.objects.create(title="Game of Thrones", isbn="9780553103540")
+        self.assertEqual(self.resolve(['9780553103540'])['9780553103540']['title'], 'Game of Thrones')
+        self.author.name = "Joanne Rowling"
+        self.author.save()
+        self.assertEqual(self.resolve(['9780747532699'])['9780747532699']['authors'][0]['name'], 'Joanne Rowling')
+
+    def test_resolve_requires_isbns(self):
+        response = self.client.post(reverse('books:book-resolve-isbns'), {'isbns': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CoalescingTest(APITestCase):
+    def run_concurrently(self, target, count):
+        results = [None] * count
+
+        def run(i):
+            results[i] = target()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_single_flight_shares_result(self):
+        flight = SingleFlight()
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return 'result'
+
+        threads, results = self.run_concurrently(lambda: flight.do('key', compute, timeout=5), 5)
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['result'] * 5)
+
+    def test_follower_computes_after_timeout(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        threads, results = self.run_concurrently(lambda: flight.do('key', lambda: release.wait(5) and 'leader', 5), 1)
+        time.sleep(0.05)
+        self.assertEqual(flight.do('key', lambda: 'follower', timeout=0.05), 'follower')
+        release.set()
+        threads[0].join()
+        self.assertEqual(results, ['leader'])
+
+    def test_file_lease_shares_across_lock_holders(self):
+        calls = []
+        release = threading.Event()
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return SharedResponse(200, [('Content-Type', 'application/json')], b'{"ok": true}')
+
+        with tempfile.TemporaryDirectory() as directory:
+            # Separate FileLease objects open separate descriptors, like separate processes.
+            threads, results = self.run_concurrently(lambda: FileLease(directory, 'key').run(compute, 5), 3)
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({result.content for result in results}, {b'{"ok": true}'})
+
+    def test_identical_list_requests_coalesced(self):
+        calls = []
+        release = threading.Event()
+
+        def slow_list(view, request, *args, **kwargs):
+            calls.append(1)
+            release.wait(5)
+            return Response({'calls': len(calls)})
+
+        url = reverse('books:book-list')
+        with mock.patch.object(BookViewSet, 'list', slow_list):
+            threads, results = self.run_concurrently(lambda: APIClient().get(url, {'genre': 'x', 'ordering': '-price'}), 4)
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({response.status_code for response in results}, {200})
+        self.assertEqual({response.content for response in results}, {b'{"calls":1}'})
+        self.assertEqual({response['Content-Type'] for response in results}, {'application/json'})
+
+    def test_only_ok_responses_are_shared(self):
+        calls = []
+        release = threading.Event()
+
+        def denied_list(view, request, *args, **kwargs):
+            calls.append(1)
+            release.wait(5)
+            return Response({'detail': 'Invalid credentials.'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        url = reverse('books:book-list')
+        with mock.patch.object(BookViewSet, 'list', denied_list):
+            threads, results = self.run_concurrently(lambda: APIClient().get(url), 3)
+            time.sleep(0.2)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(calls), 3)
+
+    def test_requests_with_credentials_not_coalesced(self):
+        factory = RequestFactory()
+        self.assertIsNone(coalesce_key(factory.get('/api/books/', HTTP_AUTHORIZATION='Basic Zm9vOmJhcg==')))
+        self.assertIsNone(coalesce_key(factory.get('/api/books/', HTTP_COOKIE='sessionid=abc')))
+
+    def test_sweep_removes_stale_files(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lease = FileLease(directory, 'old')
+            lease.run(lambda: SharedResponse(200, [], b'{}'), 1)
+            held = Path(directory) / 'held.lock'
+            held.touch()
+            fresh = FileLease(directory, 'fresh')
+            fresh.run(lambda: SharedResponse(200, [], b'{}'), 1)
+            stale = time.time() - 3600
+            for path in [lease.lock_path, lease.result_path, held]:
+                os.utime(path, (stale, stale))
+            fd = os.open(held, os.O_RDWR)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                FileLease.sweep(directory, max_age=60)
+            finally:
+                os.close(fd)
+            self.assertEqual(
+                sorted(path.name for path in Path(directory).iterdir()),
+                ['fresh.lock', 'fresh.response', 'held.lock'],
+            )
+
+    def test_key_normalizes_params_and_skips_html(self):
+        factory = RequestFactory()
+        self.assertEqual(
+            coalesce_key(factory.get('/api/books/', {'genre': 'x', 'authors': ['2', '1']})),
+            coalesce_key(factory.get('/api/books/?authors=1&genre=x&authors=2')),
+        )
+        self.assertIsNone(coalesce_key(factory.get('/api/books/', HTTP_ACCEPT='text/html')))
+        self.assertIsNone(coalesce_key(factory.post('/api/books/')))
+
+    @override_settings(ALLOWED_HOSTS=['a.example', 'b.example'])
+    def test_key_includes_host_and_scheme(self):
+        factory = RequestFactory()
+        keys = {
+            coalesce_key(factory.get('/api/books/', HTTP_HOST='a.example')),
+            coalesce_key(factory.get('/api/books/', HTTP_HOST='b.example')),
+            coalesce_key(factory.get('/api/books/', HTTP_HOST='a.example', secure=True)),
+        }
+        self.assertEqual(len(keys), 3)
+
+
+class TrafficWarmingTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.author = Author.objects.create(name="J.K. Rowling")
+        self.book = Book.objects.create(title="Harry Potter", genre="Fantasy", price=Decimal("60.00"))
+        self.book.authors.add(self.author)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        traffic.recorder._reset()
+        self.addCleanup(traffic.recorder._reset)
+
+    def traffic_settings(self, **overrides):
+        return self.settings(BOOKS_TRAFFIC_DIR=self.directory.name, BOOKS_TRAFFIC_SAMPLE_RATE=1.0, **overrides)
+
+    def test_request_key_normalized(self):
+        self.assertEqual(
+            traffic.request_key('/api/books/', QueryDict('ordering=-price&authors=2&authors=1&genre=')),
+            '/api/books/?authors=1&authors=2&ordering=-price',
+        )
+
+    def test_middleware_records_api_requests(self):
+        with self.traffic_settings():
+            client = APIClient()
+            for _ in range(3):
+                client.get(reverse('books:book-list'), {'ordering': '-price', 'genre': 'Fantasy'})
+            client.get(reverse('books:book-detail', args=[self.book.id]))
+            client.get(reverse('books:book_list'))
+            client.get(reverse('books:book-detail', args=[0]))
+            traffic.recorder.flush(force=True)
+            keys = traffic.top_keys(10)
+        self.assertEqual(keys, [
+            ('/api/books/?genre=Fantasy&ordering=-price', 3),
+            (f'/api/books/{self.book.id}/', 1),
+        ])
+
+    def test_top_keys_merges_workers_and_drops_old_windows(self):
+        with self.traffic_settings(BOOKS_TRAFFIC_WINDOWS=2):
+            window = traffic.current_window()
+            metrics.write_snapshot(Path(self.directory.name) / 'traffic-a.json', {
+                str(window): {'/a': 2}, str(window - 1): {'/b': 4}, str(window - 5): {'/c': 100},
+            })
+            metrics.write_snapshot(Path(self.directory.name) / 'traffic-b.json', {str(window): {'/a': 3}})
+            self.assertEqual(traffic.top_keys(10), [('/a', 5), ('/b', 4)])
+
+    def test_top_keys_deletes_expired_files(self):
+        with self.traffic_settings(BOOKS_TRAFFIC_WINDOW_SECONDS=60, BOOKS_TRAFFIC_WINDOWS=2):
+            path = Path(self.directory.name) / 'traffic-old.json'
+            metrics.write_snapshot(path, {str(traffic.current_window() - 2): {'/old': 7}})
+            os.utime(path, (time.time() - 121, time.time() - 121))
+            self.assertEqual(traffic.top_keys(10), [])
+            self.assertFalse(path.exists())
+
+    def test_warm_cache_replays_top_keys(self):
+        with self.traffic_settings():
+            traffic.recorder.record('/api/books/by_genre/?genre=fantasy')
+            traffic.recorder.record('/api/books/expensive_books/?min_price=50')
+            traffic.recorder.record('/api/books/?genre=Fantasy')
+            traffic.recorder.flush(force=True)
+            out = StringIO()
+            call_command('warm_cache', top=10, threads=1, host='testserver', stdout=out)
+        self.assertIn('Warmed 3/3 request keys', out.getvalue())
+        self.assertEqual(
+            set(MaterializedResult.objects.values_list('action', 'param')),
+            {('by_genre', 'fantasy'), ('expensive_books', '50')},
+        )
+
+    def test_warm_cache_respects_budget(self):
+        with self.traffic_settings():
+            traffic.recorder.record('/api/books/')
+            traffic.recorder.flush(force=True)
+            out = StringIO()
+            call_command('warm_cache', threads=1, budget=0, host='testserver', stdout=out)
+        self.assertIn('Warmed 0/1 request keys', out.getvalue())
+        self.assertIn('1 skipped', out.getvalue())
+
+
+class LoadTestCommandTest(TransactionTestCase):
+    # Workers run in their own threads and connections, so the data must be committed.
+
+    def setUp(self):
+        author = Author.objects.create(name="Load Author")
+        for i in range(12):
+            book = Book.objects.create(
+                title=f"Load Book {i}", genre=("Fantasy", "History")[i % 2], price=Decimal(10 + i)
+            )
+            book.authors.add(author)
+
+    def run_loadtest(self, **options):
+        out = StringIO()
+        call_command('loadtest', host='testserver', stdout=out, stderr=StringIO(), **options)
+        return json.loads(out.getvalue())
+
+    def test_read_scenario_report(self):
+        report = self.run_loadtest(scenario='detail', workers=2, requests=20)
+        self.assertEqual(report['requests'], 20)
+        self.assertEqual(report['errors'], 0)
+        self.assertEqual(report['status_codes'], {'200': 20})
+        self.assertEqual(report['environment']['workers'], 2)
+        self.assertGreater(report['queries']['total'], 0)
+        self.assertEqual(set(report['operations']), {'book_detail', 'author_detail'})
+        self.assertIsNotNone(report['latency_ms']['p99'])
+
+    def test_asgi_write_scenario_cleans_up(self):
+        report = self.run_loadtest(app='asgi', scenario='writes', workers=1, requests=15, allow_writes=True)
+        self.assertEqual(report['errors'], 0)
+        self.assertIn('201', report['status_codes'])
+        self.assertFalse(Book.objects.filter(title__startswith=loadtest.LOADTEST_PREFIX).exists())
+        self.assertEqual(Book.objects.count(), 12)
+
+    def test_write_scenario_requires_flag(self):
+        with self.assertRaises(CommandError):
+            call_command('loadtest', scenario='mixed', requests=1)
+
+    def test_summarize(self):
+        result = {
+            'samples': [('filter', 200, 0.010, 100), ('filter', 500, 0.030, 10), ('search', 200, 0.020, 50)],
+            'queries': 9,
+            'counted_requests': 3,
+        }
+        report = loadtest.summarize(result, 1.5)
+        self.assertEqual(report['requests_per_sec'], 2.0)
+        self.assertEqual(report['error_rate'], round(1 / 3, 4))
+        self.assertEqual(report['latency_ms']['p50'], 20.0)
+        self.assertEqual(report['latency_ms']['max'], 30.0)
+        self.assertEqual(report['queries'], {'total': 9, 'per_request': 3.0})
+        self.assertEqual(report['operations']['filter']['errors'], 1)
+        self.assertEqual(report['bytes_out'], 160)
+
+
+class StartupProfileTest(TestCase):
+    def test_parse_importtime_splits_phases(self):
+        lines = [
+            'import time: self [us] | cumulative | imported package',
+            'import time:       120 |        120 | encodings',
+            f'{startup.MARKER} ["_interpreter", 0.0]',
+            'import time:       300 |        300 |   django.db.models.fields',
+            'import time:       200 |        500 | django.db.models',
+            'import time:      1000 |       1000 | yaml',
+            f'{startup.MARKER} ["setup", 0.25]',
+            f'{startup.MARKER} ["_error", "GET /x returned 404"]',
+            'import time:        50 |         50 | books.views',
+            f'{startup.MARKER} ["GET /x", 0.01]',
+        ]
+        phases, errors = startup.parse_importtime(lines)
+        self.assertEqual([phase['phase'] for phase in phases], ['_interpreter', 'setup', 'GET /x'])
+        self.assertEqual(errors, ['GET /x returned 404'])
+        summary = startup.summarize_imports(phases[1]['imports'], top=10)
+        self.assertEqual(summary['import_ms'], 1.5)
+        self.assertEqual(summary['packages'], [{'package': 'yaml', 'ms': 1.0}, {'package': 'django.db', 'ms': 0.5}])
+        self.assertEqual(summary['imported_by_phase'][0], {'module': 'yaml', 'ms': 1.0})
+
+    def test_setup_does_not_import_drf(self):
+        out = StringIO()
+        call_command('profile_startup', repeat=1, top=1000, paths=['/metrics'], json=True, stdout=out)
+        report = json.loads(out.getvalue())
+        phases = {entry['phase']: {package['package'] for package in entry['packages']} for entry in report['phases']}
+        self.assertEqual(list(phases), ['setup', 'application', 'GET /metrics'])
+        self.assertFalse({'books.views', 'rest_framework.serializers'} & (phases['setup'] | phases['application']))
+        self.assertGreater(report['boot_ms'], 0)
+
+
+class WritableAuthorsTest(APITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.create_user(username='writer', password='pass'))
+        self.rowling = Author.objects.create(name="J.K. Rowling")
+        self.martin = Author.objects.create(name="George R.R. Martin")
+        self.tolkien = Author.objects.create(name="J.R.R. Tolkien")
+        self.book = Book.objects.create(title="Anthology", genre="Fantasy")
+        self.book.authors.add(self.rowling, self.martin)
+        self.url = reverse('books:book-detail', args=[self.book.id])
+        self.signals = []
+        m2m_changed.connect(self.record_signal, sender=Book.authors.through)
+        self.addCleanup(m2m_changed.disconnect, self.record_signal, sender=Book.authors.through)
+
+    def record_signal(self, action, **kwargs):
+        self.signals.append((action, kwargs.get('added'), kwargs.get('removed')))
+
+    def author_ids(self):
+        return set(self.book.authors.values_list('pk', flat=True))
+
+    def through_writes(self, queries):
+        table = Book.authors.through._meta.db_table
+        return [
+            query['sql'].split()[0] for query in queries
+            if table in query['sql'] and not query['sql'].startswith('SELECT')
+        ]
+
+    def test_create_with_author_ids(self):
+        response = self.client.post(reverse('books:book-list'), {
+            'title': 'The Hobbit', 'authors': [self.tolkien.id],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([author['name'] for author in response.data['authors']], ['J.R.R. Tolkien'])
+        self.assertEqual(self.signals, [('post_set', {self.tolkien.id}, set())])
+
+    def test_update_only_writes_the_difference(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(self.url, {'authors': [self.martin.id, self.tolkien.id]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [author['name'] for author in response.data['authors']], ['George R.R. Martin', 'J.R.R. Tolkien']
+        )
+        self.assertEqual(self.author_ids(), {self.martin.id, self.tolkien.id})
+        self.assertEqual(self.through_writes(queries.captured_queries), ['DELETE', 'INSERT'])
+        author_lookups = [
+            query for query in queries.captured_queries
+            if query['sql'].startswith('SELECT') and 'FROM "books_author"' in query['sql']
+            and '"books_book_authors"' not in query['sql']
+        ]
+        self.assertEqual(len(author_lookups), 1)
+        self.assertEqual(self.signals, [('post_set', {self.tolkien.id}, {self.rowling.id})])
+
+    def test_unchanged_authors_write_nothing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(self.url, {
+                'title': 'Anthology', 'authors': [self.martin.id, self.rowling.id, self.martin.id],
+            }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.through_writes(queries.captured_queries), [])
+        self.assertEqual(self.signals, [])
+
+    def test_accepts_author_objects_and_form_data(self):
+        authors = self.client.get(self.url).data['authors']
+        response = self.client.patch(self.url, {'authors': [*authors, {'id': self.tolkien.id}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(self.author_ids()), 3)
+        response = self.client.patch(self.url, {'authors': [self.rowling.id]}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.author_ids(), {self.rowling.id})
+
+    def test_omitted_authors_are_kept(self):
+        response = self.client.patch(self.url, {'genre': 'Epic Fantasy'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.author_ids(), {self.rowling.id, self.martin.id})
+        self.assertEqual(self.signals, [])
+
+    def test_invalid_authors_rejected(self):
+        for value in (
+            [self.tolkien.id, 9999], ['abc'], [True], str(self.tolkien.id), {'id': self.tolkien.id},
+            ['\u00b2'], ['\u0663'], ['99999999999999999999999'], [2 ** 63], [-1],
+        ):
+            response = self.client.patch(self.url, {'authors': value}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+            self.assertIn('authors', response.data)
+        self.assertIn('9999', str(self.client.patch(self.url, {'authors': [9999]}, format='json').data))
+        for value in ([-1], ['-1'], ['9' * 5000]):
+            response = self.client.patch(self.url, {'authors': value}, format='json')
+            self.assertIn('does not exist', str(response.data['authors']), value)
+        self.assertEqual(self.author_ids(), {self.rowling.id, self.martin.id})
+
+    @override_settings(BOOKS_MATERIALIZED_MIN_HITS=1)
+    def test_materialized_results_follow_author_changes(self):
+        self.client.get(reverse('books:book-by-genre'), {'genre': 'fantasy'})
+        self.client.patch(self.url, {'authors': [self.tolkien.id]}, format='json')
+        response = self.client.get(reverse('books:book-by-genre'), {'genre': 'fantasy'})
+        data = response_json(response)
+        self.assertEqual([author['name'] for author in data[0]['authors']], ['J.R.R. Tolkien'])
+
+    def test_browsable_api_renders(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='text/html')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ChangeFeedTest(APITestCase):
+    def setUp(self):
+        self.url = reverse('books:changes')
+        self.author = Author.objects.create(name="J.R.R. Tolkien")
+        self.book = Book.objects.create(title="The Hobbit", genre="Fantasy", price=Decimal('12.50'))
+        self.cursor = self.client.get(self.url, {'limit': 1000}).data['next_cursor']
+
+    def changes(self, **params):
+        response = self.client.get(self.url, {'since': self.cursor, **params})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def summary(self, data):
+        return [(change['model'], change['id'], change['action']) for change in data['changes']]
+
+    def test_created_and_updated(self):
+        book = Book.objects.create(title="The Silmarillion")
+        self.author.name = "John Ronald Reuel Tolkien"
+        self.author.save()
+        data = self.changes()
+        self.assertEqual(self.summary(data), [
+            ('book', book.id, 'created'), ('author', self.author.id, 'updated'),
+        ])
+        self.assertEqual(data['changes'][0]['data']['title'], "The Silmarillion")
+        self.assertEqual(data['changes'][1]['data']['name'], "John Ronald Reuel Tolkien")
+        self.assertFalse(data['has_more'])
+        self.assertEqual(data['next_cursor'], data['changes'][-1]['cursor'])
+
+    def test_deleted(self):
+        book_id = self.book.id
+        self.book.delete()
+        data = self.changes()
+        self.assertEqual(self.summary(data), [('book', book_id, 'deleted')])
+        self.assertIsNone(data['changes'][0]['data'])
+
+    def test_author_links_update_books(self):
+        before = self.book.updated_at
+        self.book.authors.add(self.author)
+        self.book.refresh_from_db()
+        self.assertGreater(self.book.updated_at, before)
+        data = self.changes()
+        self.assertEqual(self.summary(data), [('book', self.book.id, 'updated')])
+        self.assertEqual([a['name'] for a in data['changes'][0]['data']['authors']], ["J.R.R. Tolkien"])
+
+        self.cursor = data['next_cursor']
+        author_id = self.author.id
+        self.author.delete()
+        self.assertEqual(self.summary(self.changes()), [
+            ('author', author_id, 'deleted'), ('book', self.book.id, 'updated'),
+        ])
+
+    def test_changes_to_one_object_collapse(self):
+        for price in ['13.00', '14.00', '15.00']:
+            self.book.price = Decimal(price)
+            self.book.save()
+        data = self.changes()
+        self.assertEqual(self.summary(data), [('book', self.book.id, 'updated')])
+        self.assertEqual(data['changes'][0]['data']['price'], '15.00')
+
+    def test_batches(self):
+        books = [Book.objects.create(title=f"Book {i}") for i in range(5)]
+        seen = []
+        while True:
+            data = self.changes(limit=2)
+            seen.extend(change['id'] for change in data['changes'])
+            self.cursor = data['next_cursor']
+            if not data['has_more']:
+                break
+        self.assertEqual(seen, [book.id for book in books])
+        self.assertEqual(self.changes()['changes'], [])
+        self.assertEqual(self.changes()['next_cursor'], self.cursor)
+
+    def test_cursor_is_monotonic(self):
+        Book.objects.create(title="First")
+        Book.objects.create(title="Second")
+        cursors = [change['cursor'] for change in self.changes()['changes']]
+        self.assertEqual(cursors, sorted(cursors))
+        self.assertEqual(ChangeLogEntry.objects.filter(pk__gt=self.cursor).count(), 2)
+
+    def test_invalid_parameters(self):
+        for params in [{'since': -1}, {'since': 'abc'}, {'limit': 0}, {'limit': 'x'}]:
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_limit_is_capped(self):
+        with self.settings(BOOKS_CHANGES_MAX_LIMIT=2):
+            for i in range(3):
+                Book.objects.create(title=f"Book {i}")
+            data = self.changes(limit=50)
+        self.assertEqual(len(data['changes']), 2)
+        self.assertTrue(data['has_more'])
+
+
+class MemoryIndexTest(APITestCase):
+    QUERIES = [
+        {},
+        {'page': 2},
+        {'page': 4},
+        {'title': 'the'},
+        {'title': '  SAGA '},
+        {'title': 'émile'},
+        {'genre': 'fantasy'},
+        {'genre': 'sci'},
+        {'min_price': '20'},
+        {'max_price': '15.5'},
+        {'min_price': '10.005', 'max_price': '30'},
+        {'min_price': '-5'},
+        {'isbn': '0-7475-3269-9'},
+        {'isbn': 'nope'},
+        {'ordering': '-price'},
+        {'ordering': 'price', 'page': 2},
+        {'ordering': '-publication_date'},
+        {'ordering': 'publication_date,-title'},
+        {'ordering': 'bogus'},
+        {'ordering': '-title', 'genre': 'fiction'},
+        {'authors': 1},
+        {'authors': [1, 2]},
+        {'all_authors': [1, 2]},
+        {'all_authors': [1, 2, 3]},
+        {'authors': [2, 3], 'all_authors': [1], 'ordering': '-price'},
+        {'authors': 3, 'isbn': '9780747532699'},
+        {'genre': 'fiction', 'min_price': '12', 'title': 'book', 'ordering': 'price'},
+    ]
+
+    def setUp(self):
+        book_index.clear()
+        self.addCleanup(book_index.clear)
+        authors = [Author.objects.create(name=name) for name in ["Ursula", "Terry", "Anne", "Zadie"]]
+        self.author_ids = [author.id for author in authors]
+        genres = ["Fantasy", "fantasy epic", "Science Fiction", "Fiction", "", "Mystery"]
+        titles = ["The Book of Sand", "a book apart", "Saga", "THE SAGA", "Émile", "émile", "Zebra", "apple"]
+        for i in range(36):
+            book = Book.objects.create(
+                title=f"{titles[i % len(titles)]} {i:02d}",
+                genre=genres[i % len(genres)],
+                price=None if i == 7 else Decimal(i * 137 % 100) + Decimal('0.01') * (i % 3),
+                publication_date=None if i == 11 else date(1950 + i * 7 % 60, 1 + i % 12, 1),
+                isbn='0-7475-3269-9' if i == 5 else None,
+            )
+            book.authors.set([authors[j] for j in range(4) if (i >> j) & 1])
+        self.query_map = {}
+
+    def url_params(self, params):
+        ids = self.author_ids
+        params = dict(params)
+        for name in ('authors', 'all_authors'):
+            if name in params:
+                value = params[name]
+                if isinstance(value, list):
+                    params[name] = [ids[v - 1] for v in value]
+                elif isinstance(value, int):
+                    params[name] = ids[value - 1]
+        return params
+
+    def get(self, params, indexed):
+        with self.settings(BOOKS_MEMORY_INDEX=indexed, BOOKS_MEMORY_INDEX_REFRESH_INTERVAL=0):
+            return self.client.get(reverse('books:book-list'), self.url_params(params))
+
+    def assertSameResults(self, params):
+        expected = self.get(params, indexed=False)
+        actual = self.get(params, indexed=True)
+        self.assertEqual(actual.status_code, expected.status_code, params)
+        self.assertEqual(actual.json(), expected.json(), params)
+
+    def test_matches_orm(self):
+        for params in self.QUERIES:
+            self.assertSameResults(params)
+            query = QueryDict(urlencode(self.url_params(params), doseq=True))
+            self.assertIsNotNone(book_index.query(query, BookViewSet.ordering_fields, BookViewSet.ordering), params)
+        self.assertEqual(book_index.loads, 1)
+
+    def test_matches_orm_after_changes(self):
+        self.get({}, indexed=True)
+        book = Book.objects.get(title="Saga 02")
+        book.title = "aardvark"
+        book.price = Decimal('99.99')
+        book.genre = "Poetry"
+        book.save()
+        Book.objects.get(title="Zebra 06").delete()
+        new = Book.objects.create(title="The Newest", genre="Fantasy", price=Decimal('20.00'))
+        new.authors.add(self.author_ids[0], self.author_ids[3])
+        Book.objects.get(title="apple 07").authors.remove(self.author_ids[0])
+        Author.objects.filter(pk=self.author_ids[1]).update(name="Aaron")
+        Author.objects.get(pk=self.author_ids[1]).save()
+        Author.objects.get(pk=self.author_ids[2]).delete()
+
+        for params in [*self.QUERIES[:20], {'authors': 1}, {'all_authors': [1, 4]}, {'genre': 'poetry'}]:
+            self.assertSameResults(params)
+        self.assertEqual(book_index.loads, 1)
+
+    def test_results_survive_compaction(self):
+        with self.settings(BOOKS_MEMORY_INDEX_REFRESH_INTERVAL=0):
+            held = book_index.query(QueryDict('ordering=-price'), BookViewSet.ordering_fields, BookViewSet.ordering)
+            expected = [(book.id, book.title, book.price) for book in held[:]]
+            Book.objects.exclude(pk=expected[0][0]).delete()
+            with mock.patch.object(Generation, 'compact_after', 0):
+                current = book_index.query(QueryDict(), BookViewSet.ordering_fields, BookViewSet.ordering)
+        self.assertEqual(book_index.loads, 2)
+        self.assertEqual([book.id for book in current[:]], [expected[0][0]])
+        self.assertEqual([(book.id, book.title, book.price) for book in held[:]], expected)
+        self.assertEqual(len(held[30:]), 6)
+
+    def test_no_book_queries(self):
+        self.get({}, indexed=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.get({'genre': 'fiction', 'ordering': '-price', 'page': 2}, indexed=True)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # Only the poll of the change log.
+        self.assertEqual(len(queries), 1)
+        self.assertIn('books_changelogentry', queries[0]['sql'])
+
+    def test_falls_back_to_orm(self):
+        for params in [
+            {'search': 'saga'},
+            {'fields': 'id,title'},
+            {'min_price': 'abc'},
+            {'min_price': '1e2'},
+            {'authors': '999999'},
+            {'all_authors': 'x'},
+            {'page': 99},
+            {'page': 'last'},
+        ]:
+            self.assertSameResults(params)
+        for query in ['min_price=abc', 'authors=999999', 'title=a%00b']:
+            self.assertIsNone(book_index.query(QueryDict(query), ['title'], ['title']), query)
+
+    def test_disabled_by_default(self):
+        with mock.patch.object(book_index, 'query') as query:
+            response = self.client.get(reverse('books:book-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        query.assert_not_called()
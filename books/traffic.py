@@ -0,0 +1,111 @@
+"""
+Records which API requests are popular so ``manage.py warm_cache`` can replay
+them after a deploy or cache flush.
+
+``TrafficRecorderMiddleware`` samples successful GET requests to the API
+viewsets and counts their normalized keys (path plus sorted query string) in
+time windows of ``BOOKS_TRAFFIC_WINDOW_SECONDS``, keeping the last
+``BOOKS_TRAFFIC_WINDOWS``. Each worker process writes its counts to
+``BOOKS_TRAFFIC_DIR``; recording is off unless that is set. Files with no
+counts left in the kept windows are deleted when they are read.
+"""
+import atexit
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .metrics import read_snapshots, write_snapshot
+from .utils import normalized_params
+
+
+def request_key(path, query_params):
+    query = urlencode(normalized_params(query_params), doseq=True)
+    return f'{path}?{query}' if query else path
+
+
+def current_window():
+    return int(time.time() // getattr(settings, 'BOOKS_TRAFFIC_WINDOW_SECONDS', 3600))
+
+
+def oldest_window():
+    return current_window() - getattr(settings, 'BOOKS_TRAFFIC_WINDOWS', 24) + 1
+
+
+class TrafficRecorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _reset(self):
+        self._windows = {}
+        self._token = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self._flushed_at = 0.0
+
+    def record(self, key):
+        window = current_window()
+        with self._lock:
+            counts = self._windows.get(window)
+            if counts is None:
+                counts = self._windows[window] = Counter()
+                oldest = oldest_window()
+                for old in [w for w in self._windows if w < oldest]:
+                    del self._windows[old]
+            counts[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {str(window): dict(counts) for window, counts in self._windows.items()}
+
+    def flush(self, force=False):
+        directory = getattr(settings, 'BOOKS_TRAFFIC_DIR', None)
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed_at < getattr(settings, 'BOOKS_TRAFFIC_FLUSH_INTERVAL', 5.0):
+            return
+        self._flushed_at = now
+        write_snapshot(Path(directory) / f'traffic-{self._token}.json', self.snapshot())
+
+
+recorder = TrafficRecorder()
+atexit.register(recorder.flush, force=True)
+
+
+def top_keys(limit):
+    """Return the ``limit`` most frequent ``(key, count)`` pairs recorded by all workers."""
+    totals = Counter()
+    oldest = oldest_window()
+    # A file last written before the oldest window began only holds expired counts.
+    span = getattr(settings, 'BOOKS_TRAFFIC_WINDOW_SECONDS', 3600) * getattr(settings, 'BOOKS_TRAFFIC_WINDOWS', 24)
+    for snapshot in read_snapshots(Path(settings.BOOKS_TRAFFIC_DIR), 'traffic-*.json', max_age=span):
+        for window, counts in snapshot.items():
+            if int(window) >= oldest:
+                totals.update(counts)
+    return totals.most_common(limit)
+
+
+class TrafficRecorderMiddleware:
+    def __init__(self, get_response):
+        if not getattr(settings, 'BOOKS_TRAFFIC_DIR', None):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'BOOKS_TRAFFIC_SAMPLE_RATE', 0.1)
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if request.method == 'GET' and response.status_code == 200 and random.random() < self.sample_rate:
+            match = request.resolver_match
+            # Only API viewset routes; template pages and /metrics aren't worth warming.
+            if match is not None and getattr(match.func, 'actions', None):
+                recorder.record(request_key(request.path, request.GET))
+                recorder.flush()
+        return response
@@ -17,5 +17,6 @@ urlpatterns = [
     path('books/<int:pk>/', views.BookDetailView.as_view(), name='book_detail'),
     
     # REST API URLs
+    path('api/changes/', views.ChangeFeedView.as_view(), name='changes'),
     path('api/', include(router.urls)),
 ] 
\ No newline at end of file
@@ -0,0 +1,56 @@
+import string
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def ascii_lower(value):
+    """Lowercase ASCII letters only, the way SQLite's case-insensitive ``LIKE`` does."""
+    return value.translate(_ASCII_LOWER)
+
+
+def normalized_params(query_params):
+    """
+    Return request parameters in a canonical form: sorted keys, sorted values
+    and no empty values, so ``?b=2&a=1&a=3`` and ``?a=3&b=2&a=1`` compare equal.
+    """
+    params = {}
+    for key, values in sorted(query_params.lists()):
+        values = sorted(value for value in values if value != '')
+        if values:
+            params[key] = values
+    return params
+
+
+def view_label(resolver_match, method):
+    """Name the view handling a request, e.g. ``BookViewSet.list`` for DRF viewsets."""
+    if resolver_match is None:
+        return None
+    func = resolver_match.func
+    cls = getattr(func, 'cls', None) or getattr(func, 'view_class', None)
+    if cls is None:
+        return resolver_match.view_name or func.__qualname__
+    action = (getattr(func, 'actions', None) or {}).get(method.lower())
+    return f'{cls.__name__}.{action}' if action else cls.__name__
+
+
+def default_host():
+    """A host name that passes ``ALLOWED_HOSTS``, for requests made in-process."""
+    for host in settings.ALLOWED_HOSTS:
+        host = host.lstrip('.')
+        if host and host != '*':
+            return host
+    return 'localhost'
+
+
+async def iterate_in_thread(iterator):
+    """
+    Yield the items of a sync iterator that reads the database, one
+    ``sync_to_async`` call each, for a streaming response served over ASGI.
+    """
+    iterator = iter(iterator)
+    done = object()
+    while (item := await sync_to_async(next, thread_sensitive=True)(iterator, done)) is not done:
+        yield item
@@ -1,13 +1,35 @@
+import json
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.http import StreamingHttpResponse
+from django.utils.functional import cached_property
 from django.views.generic import ListView, DetailView
 from rest_framework import viewsets
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 
+from . import changes, materialized
+from .memory_index import book_index
 from .models import Author, Book
-from .serializers import BookSerializer, AuthorSerializer, BookListSerializer
+from .serializers import (
+    BookSerializer, AuthorSerializer, BookListSerializer, ChangesQuerySerializer, ISBNResolveSerializer,
+    requested_fieldsets,
+)
+from .coalesce import CoalescingViewMixin
 from .filters import BookFilter
+from .isbn import isbn_cache, normalize_isbn
+from .metrics import phase
+from .renderers import ColumnarJSONRenderer, ColumnarQuery
+from .utils import iterate_in_thread
 
 
 class AuthorListView(ListView):
@@ -35,7 +57,107 @@ class BookDetailView(DetailView):
 
 
 # REST API ViewSets
-class AuthorViewSet(viewsets.ModelViewSet):
+class InstrumentedPaginator(Paginator):
+    @cached_property
+    def count(self):
+        with phase('count'):
+            return super().count
+
+
+class InstrumentedPageNumberPagination(PageNumberPagination):
+    django_paginator_class = InstrumentedPaginator
+
+
+class InstrumentedViewMixin:
+    """
+    Splits DRF requests into phases for ``MetricsMiddleware``. Handler time
+    that isn't filtering, querying or rendering is recorded as ``serialize``.
+    """
+    pagination_class = InstrumentedPageNumberPagination
+
+    def dispatch(self, request, *args, **kwargs):
+        with phase('serialize'):
+            return super().dispatch(request, *args, **kwargs)
+
+    def filter_queryset(self, queryset):
+        with phase('filter'):
+            return super().filter_queryset(queryset)
+
+    def paginate_queryset(self, queryset):
+        with phase('query'):
+            return super().paginate_queryset(queryset)
+
+    def get_object(self):
+        with phase('query'):
+            return super().get_object()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if isinstance(response, Response):
+            with phase('render'):
+                response.render()
+        return response
+
+
+class SparseFieldsetViewMixin:
+    """
+    Pushes the ``?fields=``/``?exclude=`` selection down into the queryset so
+    only the serialized columns and relations are loaded.
+    """
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        fields, exclude = requested_fieldsets(self.request)
+        serializer = self.get_serializer_class()(fields=fields, exclude=exclude)
+        return serializer.prune_queryset(queryset)
+
+
+class ColumnarListMixin:
+    """
+    Adds the columnar renderer and, when it is selected, builds list
+    responses directly from ``values_list()`` rows.
+    """
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarJSONRenderer]
+
+    def list(self, request, *args, **kwargs):
+        if not isinstance(request.accepted_renderer, ColumnarJSONRenderer):
+            return super().list(request, *args, **kwargs)
+        query = ColumnarQuery(self.get_serializer(), self.filter_queryset(self.get_queryset()))
+        if not query.supported:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(query.values())
+        if page is not None:
+            return self.get_paginated_response(query.columns(page))
+        return Response(query.columns(query.values()))
+
+
+class MemoryIndexListMixin:
+    """
+    Answers list requests from ``books.memory_index`` when ``BOOKS_MEMORY_INDEX``
+    is set. Searches, sparse fieldsets and parameters the index can't evaluate
+    go through the queryset as usual.
+    """
+
+    def list(self, request, *args, **kwargs):
+        if (
+            not getattr(settings, 'BOOKS_MEMORY_INDEX', False)
+            or request.query_params.get(api_settings.SEARCH_PARAM)
+            or requested_fieldsets(request) != (None, None)
+        ):
+            return super().list(request, *args, **kwargs)
+        with phase('filter'):
+            books = book_index.query(request.query_params, self.ordering_fields, self.ordering)
+        if books is None:
+            return super().list(request, *args, **kwargs)
+        page = self.paginate_queryset(books)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(books[:], many=True).data)
+
+
+class AuthorViewSet(CoalescingViewMixin, InstrumentedViewMixin, SparseFieldsetViewMixin, ColumnarListMixin, viewsets.ModelViewSet):
     queryset = Author.objects.all()
     serializer_class = AuthorSerializer
     filter_backends = [SearchFilter, OrderingFilter]
@@ -44,7 +166,10 @@ class AuthorViewSet(viewsets.ModelViewSet):
     ordering = ['name']
 
 
-class BookViewSet(viewsets.ModelViewSet):
+class BookViewSet(
+    CoalescingViewMixin, InstrumentedViewMixin, SparseFieldsetViewMixin, ColumnarListMixin, MemoryIndexListMixin,
+    viewsets.ModelViewSet,
+):
     queryset = Book.objects.all()
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     filterset_class = BookFilter
@@ -60,13 +185,66 @@ class BookViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def by_genre(self, request):
         genre = request.query_params.get('genre', '')
-        books = self.queryset.filter(genre__icontains=genre)
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        books = self.get_queryset().filter(genre__icontains=genre)
+        return self.materialized_response('by_genre', genre, books)
 
     @action(detail=False, methods=['get'])
     def expensive_books(self, request):
         min_price = request.query_params.get('min_price', 50)
-        books = self.queryset.filter(price__gte=min_price)
-        serializer = self.get_serializer(books, many=True)
-        return Response(serializer.data)
+        books = self.get_queryset().filter(price__gte=min_price)
+        return self.materialized_response('expensive_books', min_price, books)
+
+    @action(detail=False, methods=['post'])
+    def resolve_isbns(self, request):
+        """Map a list of ISBNs (any form) to books, or null when unknown."""
+        serializer = ISBNResolveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        isbns = {value: normalize_isbn(value) for value in serializer.validated_data['isbns']}
+        found, missing = isbn_cache.get_many(set(isbns.values()))
+        if missing:
+            books = Book.objects.filter(isbn__in=missing).prefetch_related('authors')
+            resolved = dict.fromkeys(missing)
+            resolved.update((book.isbn, BookSerializer(book).data) for book in books)
+            isbn_cache.set_many(resolved)
+            found.update(resolved)
+        return Response({'results': {value: found[isbn] for value, isbn in isbns.items()}})
+
+    def materialized_response(self, name, value, queryset):
+        """
+        Serve an action from its materialized result, falling back to
+        ``queryset`` when it can't be materialized or sparse fields are requested.
+
+        With ``?page=`` the response is paginated; otherwise the whole list is
+        returned, streamed when rendering plain JSON.
+        """
+        request = self.request
+        paginate = self.paginator.page_query_param in request.query_params
+        result = None
+        if requested_fieldsets(request) == (None, None):
+            result = materialized.get_result(name, value)
+        if result is None:
+            if paginate:
+                page = self.paginate_queryset(queryset)
+                return self.get_paginated_response(self.get_serializer(page, many=True).data)
+            return Response(self.get_serializer(queryset, many=True).data)
+
+        payloads = materialized.ordered_payloads(result)
+        if paginate:
+            page = self.paginate_queryset(payloads)
+            return self.get_paginated_response([json.loads(payload) for payload in page])
+        if type(request.accepted_renderer) is JSONRenderer:
+            chunks = materialized.stream_json_array(payloads.iterator(chunk_size=500))
+            if isinstance(request._request, ASGIRequest):
+                # Django's ASGI handler collects a sync iterator into a list before sending it.
+                chunks = iterate_in_thread(chunks)
+            return StreamingHttpResponse(chunks, content_type='application/json')
+        return Response([json.loads(payload) for payload in payloads])
+
+
+class ChangeFeedView(APIView):
+    """Books and authors changed since ``?since=<cursor>``, oldest first, in batches of ``?limit=``."""
+
+    def get(self, request):
+        query = ChangesQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return Response(changes.changes_since(query.validated_data['since'], query.validated_data.get('limit')))
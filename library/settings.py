@@ -43,6 +43,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'books.metrics.MetricsMiddleware',
+    'books.slowlog.SlowQueryLogMiddleware',
+    'books.traffic.TrafficRecorderMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,3 +140,55 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
 }
+
+# Request metrics, exported on /metrics. Set BOOKS_METRICS_DIR to a directory
+# shared by all worker processes to aggregate their histograms. A worker's file
+# is folded into metrics-dead.json once it goes BOOKS_METRICS_RETENTION seconds
+# without a rewrite.
+BOOKS_METRICS_DIR = None
+BOOKS_METRICS_FLUSH_INTERVAL = 1.0
+BOOKS_METRICS_RETENTION = 86400
+
+# Slow query log (off unless BOOKS_SLOW_QUERY_LOG names a file). Summarize it
+# with `manage.py slow_queries`.
+BOOKS_SLOW_QUERY_LOG = None
+BOOKS_SLOW_QUERY_THRESHOLD_MS = 100
+BOOKS_SLOW_QUERY_SAMPLE_RATE = 1.0
+BOOKS_SLOW_QUERY_LOG_MAX_BYTES = 10 * 1024 * 1024
+BOOKS_SLOW_QUERY_LOG_BACKUP_COUNT = 5
+
+# Materialized by_genre/expensive_books results: a value is materialized after
+# BOOKS_MATERIALIZED_MIN_HITS requests in one worker; at most
+# BOOKS_MATERIALIZED_MAX_RESULTS are kept (least recently used are evicted) and
+# results unused for BOOKS_MATERIALIZED_TTL seconds are dropped.
+BOOKS_MATERIALIZED_MAX_RESULTS = 100
+BOOKS_MATERIALIZED_MIN_HITS = 3
+BOOKS_MATERIALIZED_TTL = 86400
+
+# In-process cache for POST /books/api/books/resolve_isbns/.
+BOOKS_ISBN_CACHE_SIZE = 10000
+BOOKS_ISBN_CACHE_TTL = 60
+
+# Identical concurrent GET requests to the API share one response. Followers
+# wait up to BOOKS_COALESCE_TIMEOUT seconds; set BOOKS_COALESCE_LOCK_DIR to a
+# directory shared by the workers to coalesce across processes too.
+BOOKS_COALESCE_TIMEOUT = 5.0
+BOOKS_COALESCE_LOCK_DIR = None
+
+# Traffic recording for `manage.py warm_cache` (off unless BOOKS_TRAFFIC_DIR
+# names a directory shared by the workers).
+BOOKS_TRAFFIC_DIR = None
+BOOKS_TRAFFIC_SAMPLE_RATE = 0.1
+BOOKS_TRAFFIC_WINDOW_SECONDS = 3600
+BOOKS_TRAFFIC_WINDOWS = 24
+BOOKS_TRAFFIC_FLUSH_INTERVAL = 5.0
+
+# Change feed at /api/changes/ (log entries per batch, by default and at most).
+BOOKS_CHANGES_PAGE_SIZE = 100
+BOOKS_CHANGES_MAX_LIMIT = 1000
+
+# In-memory index for BookViewSet list requests (books.memory_index). Each
+# worker keeps a copy of the catalog and polls the change log for updates at
+# most every BOOKS_MEMORY_INDEX_REFRESH_INTERVAL seconds, so lists can be that stale.
+BOOKS_MEMORY_INDEX = False
+BOOKS_MEMORY_INDEX_REFRESH_INTERVAL = 1.0